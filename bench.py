@@ -1,10 +1,13 @@
+import argparse
+import os
 import resource
 import timeit
 from math import floor
 from lib.core import read_inventory_data
 from lib.route import *
 from lib.tui import show_result
-from random import sample
+from random import sample, seed, choice
+from time import time
 
 TEST_CASES = [
     [108335],
@@ -53,6 +56,7 @@ TEST_CASES = [
 DEFAULT_REPS = (
     1  # Default repetitions to test each algorithm and calculate an average time
 )
+SEARCH_PAIRS = 2000  # Random start/end pairs to compare single-pair searches with
 
 
 def get_avg_runtime(f_alg, reps=DEFAULT_REPS):
@@ -70,6 +74,86 @@ def get_avg_runtime(f_alg, reps=DEFAULT_REPS):
     return execution_time
 
 
+def bench_search(map_data, pairs=SEARCH_PAIRS):
+    """
+    Compare the single-pair searches on random pairs of empty grids: node
+    expansions and time of the plain search against A*
+    """
+    seed(0)
+    free = [(int(x), int(y)) for x, y in map_data.coords]
+    pairs = [(choice(free), choice(free)) for _ in range(pairs)]
+
+    searches = [
+        ("Dijkstra", lambda s, e, stats: costs_from(map_data, s, [e], stats)[e]),
+        ("A*", lambda s, e, stats: astar(map_data, s, e, stats)),
+    ]
+    results = []
+    for name, f_search in searches:
+        stats = {"expanded": 0}
+        t_start = time()
+        routes = [f_search(s, e, stats) for s, e in pairs]
+        results.append((name, time() - t_start, stats["expanded"], routes))
+
+    print(f"Single-pair search on {len(pairs)} random pairs: ")
+    print("Search\t\t|Time\t\t|Expansions")  # Header
+    for name, t, expanded, routes in results:
+        print(f"{name:<8}\t|{t:.3f}s\t\t|{expanded / len(pairs):.1f} per pair")
+    print(f"Same routes: {all(r[3] == results[0][3] for r in results)}")
+
+
+def bench_bounds(prod_db, map_data, test_cases=TEST_CASES[:4]):
+    """
+    Compare the lower bounds of branch and bound: tree nodes expanded and
+    time to solve each test case
+    """
+    print("Branch and bound lower bounds: ")
+    print("Size\t|Bound\t\t|Time\t\t|Expansions\t|Cost")  # Header
+    for order in test_cases:
+        item_nodes = prod_to_node(prod_db=prod_db, map_data=map_data, id_list=order)
+        start_node = SingleNode(coord=(0, 0), map=map_data)
+        end_node = SingleNode(coord=(0, 0), map=map_data)
+        nodes = [start_node] + item_nodes + [end_node]
+        cm = generate_cost_graph(nodes, start_node=start_node, end_node=end_node)
+
+        for bound in BOUNDS:
+            seed(0)  # Same initial node for all bounds
+            stats = {"expanded": 0}
+            t_start = time()
+            total_cost, _ = branch_and_bound(cm, bound=bound, stats=stats)
+            print(
+                f"{len(order)}\t|{bound:<10}\t|{time() - t_start:.3f}s\t\t|{stats['expanded']}\t\t|{total_cost:.0f}"
+            )
+
+
+def bench_parallel(prod_db, map_data, test_cases=TEST_CASES[2:4]):
+    """
+    Measure the speedup of parallel branch and bound over the sequential
+    one, with 1 to os.cpu_count() processes
+    """
+    counts = sorted({1, 2, 4, 8, 16, os.cpu_count()})
+    counts = [count for count in counts if count <= os.cpu_count()]
+    print(f"Parallel branch and bound on {os.cpu_count()} CPUs: ")
+    print("Size\t|Processes\t|Time\t\t|Speedup\t|Cost")  # Header
+    for order in test_cases:
+        item_nodes = prod_to_node(prod_db=prod_db, map_data=map_data, id_list=order)
+        start_node = SingleNode(coord=(0, 0), map=map_data)
+        end_node = SingleNode(coord=(0, 0), map=map_data)
+        nodes = [start_node] + item_nodes + [end_node]
+        cm = generate_cost_graph(nodes, start_node=start_node, end_node=end_node)
+
+        seed(0)
+        t_start = time()
+        total_cost, _ = branch_and_bound_dfs(cm)
+        t_seq = time() - t_start
+        print(f"{len(order)}\t|sequential\t|{t_seq:.3f}s\t\t|1.00x\t\t|{total_cost:.0f}")
+        for count in counts:
+            seed(0)
+            t_start = time()
+            total_cost, _ = parallel_branch_and_bound(cm, processes=count)
+            t = time() - t_start
+            print(f"{len(order)}\t|{count}\t\t|{t:.3f}s\t\t|{t_seq / t:.2f}x\t\t|{total_cost:.0f}")
+
+
 def get_peak_mem():
     peak_mem_in_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
     peak_mem_str = f"{peak_mem_in_kb} KiB ({(peak_mem_in_kb/1024):0.2f} MiB)"
@@ -77,13 +161,45 @@ def get_peak_mem():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark routing algorithms")
+    parser.add_argument(
+        "--search",
+        action="store_true",
+        help="Only compare the single-pair search algorithms",
+    )
+    parser.add_argument(
+        "--bounds",
+        action="store_true",
+        help="Only compare the lower bounds of branch and bound",
+    )
+    parser.add_argument(
+        "--parallel",
+        action="store_true",
+        help="Only measure the speedup of parallel branch and bound",
+    )
+    args = parser.parse_args()
+
     # startup phase
     conf = Config()
 
     read_inventory_data("data/qvBox-warehouse-data-s23-v01.txt", conf=conf)
+    warm_up()
+    solver_pool()
     prod_db = conf.prod_db
     map_data = conf.map_data
 
+    if args.search:
+        bench_search(map_data)
+        exit()
+
+    if args.bounds:
+        bench_bounds(prod_db, map_data)
+        exit()
+
+    if args.parallel:
+        bench_parallel(prod_db, map_data)
+        exit()
+
     # testing phase
 
     nn_times = []
@@ -105,8 +221,8 @@ if __name__ == "__main__":
 
         conf.default_algorithm = "n"
         print(f"Testing nearest neighbor with input {order}...")
-        instr, total_cost, route, timeout = find_route(item_nodes, start_node, end_node, "n", -1)
-        show_result(map_data, conf, item_locations, instr, total_cost, route, timeout)
+        instr, total_cost, route, stopped = find_route(item_nodes, start_node, end_node, "n", -1)
+        show_result(map_data, conf, item_locations, instr, total_cost, route, stopped)
         nn_times.append(
             get_avg_runtime(
                 lambda: find_route(item_nodes, start_node, end_node, "n", -1)
@@ -115,8 +231,8 @@ if __name__ == "__main__":
 
         conf.default_algorithm = "b"
         print(f"Testing BnB with input {order}...")
-        instr, total_cost, route, timeout = find_route(item_nodes, start_node, end_node, "b", -1)
-        show_result(map_data, conf, item_locations, instr, total_cost, route, timeout)
+        instr, total_cost, route, stopped = find_route(item_nodes, start_node, end_node, "b", -1)
+        show_result(map_data, conf, item_locations, instr, total_cost, route, stopped)
         bnb_times.append(
             get_avg_runtime(
                 lambda: find_route(item_nodes, start_node, end_node, "b", -1)
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+"""
+Progress reporting and cancellation of solvers
+"""
+
+# Seconds between checks for cancellation while a solver waits for a process pool
+POLL_INTERVAL = 0.1
+
+
+class Cancelled(Exception):
+    """
+    Raised by Progress.check() to stop a solver that has been cancelled
+    """
+
+
+class Progress:
+    """
+    Best tour found so far by a solver, so that a solver stopped before it
+    is done still has a tour to show for it.
+
+    Solvers call improve() with every tour better than the ones before, and
+    check() regularly, which raises Cancelled once cancel (anything with an
+    is_set() method, e.g. a multiprocessing.Event) is set. on_improve, if
+    given, is called with the cost and path of every improvement.
+
+    low_memory is set the same way when the solver is close to its memory
+    budget, and solvers that can should then go on in a way that takes no
+    more memory (see memory_low()).
+    """
+
+    def __init__(self, on_improve=None, cancel=None, low_memory=None) -> None:
+        self.cost = float("inf")
+        self.path: list[int] = None
+        self.on_improve = on_improve
+        self.cancel = cancel
+        self.low_memory = low_memory
+
+    def improve(self, cost: float, path: list[int]):
+        if cost < self.cost:
+            self.cost, self.path = cost, list(path)
+            if self.on_improve is not None:
+                self.on_improve(self.cost, self.path)
+
+    def check(self):
+        if self.cancel is not None and self.cancel.is_set():
+            raise Cancelled
+
+    def memory_low(self) -> bool:
+        return self.low_memory is not None and self.low_memory.is_set()
@@ -1,27 +1,48 @@
 from __future__ import annotations
 import numpy as np
-from .core import Node, SingleNode, AccessPoint, PriorityQueue
+from .core import Config, PriorityQueue
+from .matrix import CostMatrix, INF
+from .nearest_neighbor import nearest_neighbor
+from .anytime import POLL_INTERVAL, Progress
 from random import choice
 from math import floor
-from copy import deepcopy, copy
+from multiprocessing import Lock, Pool, RawValue
+import multiprocessing
+import os
+
+# Tree nodes kept per depth by beam_search(), the default of Config
+BEAM_WIDTH = Config().beam_width
+
+# Lower bounds SearchTree can rank tree nodes by
+BOUNDS = ("reduce", "assignment")
 
 
 class TreeNode:
+    """
+    A node of the search tree. Only the path and the reductions applied to
+    the matrix since the root are kept, so a tree node takes O(N) memory;
+    its reduced matrix is rebuilt with restore_matrix() when it is expanded.
+
+    cost is the lower bound given by the reductions, and bound the lower
+    bound the search ranks and prunes tree nodes by, which is at least cost.
+    """
+
+    __slots__ = ("cost", "bound", "path", "row_reduced", "col_reduced")
+
     def __init__(
         self,
         cost: int,
-        path: list[AccessPoint],
-        matrix: np.ndarray,
-        parent_tree_node: TreeNode = None,
+        path: list[int],
+        row_reduced: np.ndarray,
+        col_reduced: np.ndarray,
+        bound: int = None,
     ) -> None:
         self.cost = cost
-        self.path = path
-        self.matrix = matrix
-        self.parent_node = parent_tree_node
-
-    @property
-    def visited_nodes(self):
-        return set([ap.parent for ap in self.path])
+        self.bound = cost if bound is None else bound
+        self.path = path  # AP indexes in the cost matrix
+        # Reductions of each node's rows/columns, on top of the root matrix's
+        self.row_reduced = row_reduced
+        self.col_reduced = col_reduced
 
 
 """
@@ -29,174 +50,705 @@ Branch and bound algorithm
 """
 
 
-def branch_and_bound(
-    nodes: list[Node | SingleNode],
-    start_ap: AccessPoint,
-    end_ap: AccessPoint,
-):
-    def mark_as_visited(mat: np.ndarray, src_ap_idx: int, dest_ap_idx: int):
-        """
-        "Visit" an AP by marking the source AP's row and the destination AP's
-        column as infinity.
-        """
-        src_node_idx = floor(src_ap_idx / 4)
-        dest_node_idx = floor(dest_ap_idx / 4)
+def mark_as_visited(mat: np.ndarray, src_ap_idx: int, dest_ap_idx: int):
+    """
+    "Visit" an AP by marking the source AP's row and the destination AP's
+    column as infinity.
+    """
+    src_node_idx = floor(src_ap_idx / 4)
+    dest_node_idx = floor(dest_ap_idx / 4)
 
-        mat[src_node_idx * 4 : (src_node_idx + 1) * 4] = float("inf")
-        mat[:, dest_node_idx * 4 : (dest_node_idx + 1) * 4] = float("inf")
+    mat[src_node_idx * 4 : (src_node_idx + 1) * 4] = float("inf")
+    mat[:, dest_node_idx * 4 : (dest_node_idx + 1) * 4] = float("inf")
 
-        # for r in range(dest_node_idx * 4, (dest_node_idx + 1) * 4):
-        #     if r != dest_ap_idx:
-        #         mat[r] = float("inf")
+    return mat
 
-        return mat
 
-    # 0. Use numba if possible
-    f_reduce_matrix = reduce_matrix
-    try:
-        from numba import jit
-
-        f_reduce_matrix = jit(nopython=True)(reduce_matrix)
-        # print("Using Numba JIT to improve BnB performance. ")
-    except ModuleNotFoundError:
-        # print("Numba not found. Running BnB with native CPython. ")
-        pass
-
-    # 1. Setup the initial matrix and reduce
-    init_mat, dict_ap_to_idx = setup_matrix(nodes=nodes)
-    # print_matrix(init_mat)
-    init_mat, init_reduced_cost = f_reduce_matrix(init_mat)
-    # print_matrix(init_mat)
-    # 3. Start branching
-    # Randomly pick an ap
-    init_node = choice(nodes)
-    # init_node = nodes[0]
-    # print(f"Initializing BnB @ {init_node.coord}")
-    init_aps = init_node.aps
+def restore_matrix(
+    root_mat: np.ndarray, tree_node: TreeNode, ap_to_idx: np.ndarray
+) -> np.ndarray:
+    """
+    Rebuild the reduced matrix of a tree node from the root's reduced matrix.
 
-    pq = PriorityQueue()
+    Reducing only subtracts a constant from all rows or all columns of a
+    node, so the tree node's matrix is the root's minus the reductions made
+    since, with the rows/columns visited along its path marked as infinity.
+    """
+    mat = (
+        root_mat
+        - np.repeat(tree_node.row_reduced, 4)[:, None]
+        - np.repeat(tree_node.col_reduced, 4)[None, :]
+    )
+    path = tree_node.path
+    for src_ap, dest_ap in zip(path, path[1:]):
+        mark_as_visited(mat, ap_to_idx[src_ap], ap_to_idx[dest_ap])
+
+    return mat
 
-    for ap in init_aps:
-        path = [ap]
-        pq.enqueue(
+
+class SearchTree:
+    """
+    The branch and bound search tree of a cost matrix, shared by the
+    searches below. The tour starts from a random node unless init_node is
+    given, and roots holds a tree node for each AP of that node.
+
+    bound is one of BOUNDS:
+    - "reduce": the row/column reduction of the matrix, 4 rows/columns
+      (one node) at a time.
+    - "assignment": the cost of the path so far, plus the cheapest way of
+      leaving every node still to be left and entering every node still to
+      be entered, solved as an assignment problem over nodes. It is never
+      below the reduction bound, and costs more to compute.
+
+    If stats is given, stats["expanded"] counts the expanded tree nodes.
+    """
+
+    def __init__(
+        self,
+        cm: CostMatrix,
+        bound: str = "reduce",
+        init_node: int = None,
+        stats: dict = None,
+    ) -> None:
+        if bound not in BOUNDS:
+            raise ValueError(f"Unknown bound {bound}, must be one of {BOUNDS}")
+        self.cm = cm
+        self.bound = bound
+        self.stats = stats
+        self.f_reduce_matrix = compiled(reduce_matrix)
+        self.f_assignment_cost = compiled(assignment_cost)
+
+        # 1. Setup the initial matrix and reduce
+        init_mat, self.ap_to_idx = setup_matrix(cm)
+        # Cheapest cost from each node to each node, for the assignment bound
+        n = cm.node_count
+        self.node_mat = init_mat.reshape(n, 4, n, 4).min(axis=(1, 3))
+        self.raw_mat = init_mat.copy()
+        # print_matrix(init_mat)
+        self.init_mat, init_reduced_cost, _, _ = self.f_reduce_matrix(init_mat)
+        # print_matrix(init_mat)
+        no_reduction = np.zeros(n)
+
+        # Randomly pick an ap
+        if init_node is None:
+            init_node = choice(range(n))
+        # init_node = 0
+        # print(f"Initializing BnB @ {cm.nodes[init_node].coord}")
+        self.roots = [
             TreeNode(
                 cost=init_reduced_cost,
                 path=[ap],
-                matrix=init_mat,
-                parent_tree_node=None,
-            ),
-            priority1=init_reduced_cost,
-            priority2=1 / len(path),
-        )
+                row_reduced=no_reduction,
+                col_reduced=no_reduction,
+            )
+            for ap in cm.node_aps(init_node)
+        ]
 
-    best_tree_node = None
+    def is_complete(self, tree_node: TreeNode) -> bool:
+        """
+        Whether the tree node's path visits all nodes and returns to the first
+        """
+        return len(tree_node.path) == self.cm.node_count + 1
 
-    while pq:
-        current_tree_node: TreeNode
-        _, current_tree_node = pq.dequeue()
-        current_ap = current_tree_node.path[-1]
+    def expand(self, tree_node: TreeNode) -> list[TreeNode]:
+        """
+        Return the children of a tree node, one per AP that can be visited
+        next, each with the lower bound on the cost of tours through its path.
+        """
+        if self.stats is not None:
+            self.stats["expanded"] = self.stats.get("expanded", 0) + 1
 
-        current_path = current_tree_node.path
-        current_mat = current_tree_node.matrix
+        cm = self.cm
+        current_path = tree_node.path
+        current_ap = current_path[-1]
         init_ap = current_path[0]
-        next_aps = []
-        # Check if all nodes have been visited
-        if len(current_tree_node.path) == len(nodes) + 1:
-            best_tree_node = current_tree_node
-            return best_tree_node.cost, best_tree_node.path[:-1]
-        elif len(current_tree_node.path) == len(nodes):
+        if len(current_path) == cm.node_count:
             next_aps = [init_ap]  # add back route
         else:
-            for ap in current_ap.dv.keys():
-                if ap.parent != init_ap.parent:
-                    next_aps.append(ap)
-
+            # APs of all nodes other than the current and the initial one
+            next_aps = np.flatnonzero(
+                (cm.node_of != cm.node_of[current_ap])
+                & (cm.node_of != cm.node_of[init_ap])
+            ).tolist()
+
+        children = []
+        current_mat = restore_matrix(self.init_mat, tree_node, self.ap_to_idx)
         for next_ap in next_aps:
-            src_ap_idx = dict_ap_to_idx[current_ap]
-            dest_ap_idx = dict_ap_to_idx[next_ap]
+            src_ap_idx = self.ap_to_idx[current_ap]
+            dest_ap_idx = self.ap_to_idx[next_ap]
             visit_cost = current_mat[src_ap_idx][dest_ap_idx]
-            if visit_cost != float("inf"):
-                # Create data copies
-                path_copy = copy(current_path)
-                mat_copy = current_mat.copy()
-
-                # Visit dest_ap and mark src/dest row/col as infinity
-                path_copy.append(next_ap)
-                mark_as_visited(mat_copy, src_ap_idx, dest_ap_idx)
-
-                # Reduce the matrix
-                mat_copy, reduced_cost = f_reduce_matrix(mat_copy)
-
-                next_cost = current_tree_node.cost + reduced_cost + visit_cost
-                pq.enqueue(
-                    TreeNode(
-                        cost=next_cost,
-                        path=path_copy,
-                        matrix=mat_copy,
-                        parent_tree_node=current_tree_node,
-                    ),
-                    next_cost,
-                    1 / len(path_copy),
+            if visit_cost == float("inf"):
+                continue
+
+            # Visit dest_ap and mark src/dest row/col as infinity
+            path_copy = current_path + [next_ap]
+            mat_copy = current_mat.copy()
+            mark_as_visited(mat_copy, src_ap_idx, dest_ap_idx)
+
+            # Unless the tour is about to close, the node visited must have a
+            # way on to a node other than the initial one, or it is a dead end
+            if len(path_copy) < cm.node_count:
+                dest_node_idx = floor(dest_ap_idx / 4)
+                dest_rows = mat_copy[dest_node_idx * 4 : (dest_node_idx + 1) * 4]
+                exits = np.isfinite(dest_rows).any(axis=0).reshape(-1, 4).any(axis=1)
+                exits[cm.node_of[init_ap]] = False
+                if not exits.any():
+                    continue
+
+            # Reduce the matrix
+            _, reduced_cost, row_reduced, col_reduced = self.f_reduce_matrix(mat_copy)
+
+            cost = tree_node.cost + reduced_cost + visit_cost
+            bound = cost
+            if self.bound == "assignment":
+                bound = max(cost, self.assignment_bound(path_copy))
+                if bound == float("inf"):
+                    continue  # No way to finish the tour
+
+            children.append(
+                TreeNode(
+                    cost=cost,
+                    path=path_copy,
+                    row_reduced=tree_node.row_reduced + row_reduced,
+                    col_reduced=tree_node.col_reduced + col_reduced,
+                    bound=bound,
                 )
-                # print(f"Enqueued {[ap.coord for ap in path_copy]}, Cost={next_cost}")
-            else:
-                pass
+            )
+
+        return children
+
+    def assignment_bound(self, path: list[int]) -> float:
+        """
+        Return the assignment bound of the tours through path
+        """
+        cm = self.cm
+        ap_to_idx = self.ap_to_idx
+        path_cost = self.raw_mat[ap_to_idx[path[:-1]], ap_to_idx[path[1:]]].sum()
+        if len(path) == cm.node_count + 1:
+            return path_cost  # Complete tour
+
+        # Nodes to leave are the unvisited ones and the current one, left
+        # from the current AP. Nodes to enter are the unvisited ones and the
+        # initial one, entered at the initial AP.
+        n = cm.node_count
+        visited = np.zeros(n, dtype=bool)
+        visited[cm.node_of[path]] = True
+        unvisited = np.flatnonzero(~visited)
+
+        m = len(unvisited) + 1
+        mat = np.full((m, m), float("inf"))
+        if m == 1:
+            mat[0, 0] = self.raw_mat[ap_to_idx[path[-1]], ap_to_idx[path[0]]]
+        else:
+            from_current = self.raw_mat[ap_to_idx[path[-1]]].reshape(n, 4).min(axis=1)
+            to_init = self.raw_mat[:, ap_to_idx[path[0]]].reshape(n, 4).min(axis=1)
+            mat[0, :-1] = from_current[unvisited]
+            mat[1:, :-1] = self.node_mat[np.ix_(unvisited, unvisited)]
+            mat[1:, -1] = to_init[unvisited]
+
+        return path_cost + self.f_assignment_cost(mat)
+
+
+def branch_and_bound(
+    cm: CostMatrix,
+    incumbent: tuple[int, list[int]] = None,
+    bound: str = "reduce",
+    stats: dict = None,
+    progress: Progress = None,
+):
+    """
+    Find the optimal tour with best-first branch and bound.
+
+    incumbent is the (cost, path) of a known tour, and defaults to the
+    nearest neighbor tour. Tree nodes whose lower bound is no better than
+    the incumbent are pruned, and the incumbent is replaced whenever a
+    cheaper complete tour is found. If nothing beats it, it is returned.
+    bound and stats are passed on to SearchTree. Every incumbent is
+    reported to progress, which is checked before every expansion. If
+    progress runs low on memory, the tree nodes in the queue are searched
+    depth first instead, which still finds the optimal tour.
+    """
+    if incumbent is None:
+        incumbent = nearest_neighbor(cm)
+    best_cost, best_path = incumbent
+    if progress is not None:
+        progress.improve(best_cost, best_path)
+
+    tree = SearchTree(cm, bound=bound, stats=stats)
 
+    pq = PriorityQueue()
+    for root in tree.roots:
+        pq.enqueue(root, priority1=root.bound, priority2=1 / len(root.path))
 
-def setup_matrix(nodes: list[Node | SingleNode]):
-    start_node = nodes[0]
-    end_node = nodes[-1]
+    while not pq.is_empty():
+        current_tree_node: TreeNode
+        _, current_tree_node = pq.dequeue()
+        if current_tree_node.bound >= best_cost:
+            # The incumbent has improved since this tree node was enqueued
+            continue
+        if progress is not None:
+            progress.check()
+            if progress.memory_low():
+                # Finish depth first, which keeps the queue from growing
+                roots = [current_tree_node] + pq.drain()
+                incumbent = (best_cost, best_path)
+                return depth_first(tree, roots, incumbent, progress=progress)
+
+        for child in tree.expand(current_tree_node):
+            if child.bound >= best_cost:
+                continue  # Prune, can't beat the incumbent
+            if tree.is_complete(child):
+                # A complete tour cheaper than the incumbent
+                best_cost, best_path = int(child.bound), child.path[:-1]
+                if progress is not None:
+                    progress.improve(best_cost, best_path)
+                continue
+
+            pq.enqueue(child, child.bound, 1 / len(child.path))
+            # print(f"Enqueued {child.path}, Cost={child.bound}")
+
+    return best_cost, best_path
+
+
+def branch_and_bound_dfs(
+    cm: CostMatrix,
+    incumbent: tuple[int, list[int]] = None,
+    bound: str = "reduce",
+    stats: dict = None,
+    progress: Progress = None,
+):
+    """
+    Find the optimal tour with depth-first branch and bound.
+
+    Same bound and pruning as branch_and_bound(), but the tree is walked
+    depth first, trying the children of a tree node cheapest first. Only
+    the children of the tree nodes on the current path are kept, so memory
+    stays bounded by the number of nodes instead of growing with the size
+    of the search, at the price of expanding some tree nodes that
+    best-first search would never reach.
+    """
+    if incumbent is None:
+        incumbent = nearest_neighbor(cm)
+
+    tree = SearchTree(cm, bound=bound, stats=stats)
+    return depth_first(tree, tree.roots, incumbent, progress=progress)
+
+
+def depth_first(
+    tree: SearchTree,
+    roots: list[TreeNode],
+    incumbent: tuple[int, list[int]],
+    shared_cost=None,
+    shared_lock=None,
+    poll=None,
+    progress: Progress = None,
+):
+    """
+    Search the subtrees under roots depth first, and return the best tour
+    found, or the incumbent if nothing beats it, which is (inf, None) when
+    there is no incumbent.
+
+    shared_cost is a multiprocessing.RawValue with the cost of the best
+    tour found by any process. It is read to prune with the tours of other
+    processes, and updated under shared_lock when this one finds a cheaper
+    tour. poll, if given, is called before every expansion. Every
+    incumbent is reported to progress, which is checked before every
+    expansion.
+    """
+    best_cost, best_path = incumbent
+    if progress is not None and best_path is not None:
+        progress.improve(best_cost, best_path)
+
+    # One list of tree nodes left to try per depth, the cheapest at the end
+    stack = [sorted(roots, key=lambda tree_node: tree_node.bound, reverse=True)]
+
+    while stack:
+        if not stack[-1]:
+            stack.pop()  # Backtrack
+            continue
+
+        current_tree_node = stack[-1].pop()
+        if poll is not None:
+            poll()
+        if progress is not None:
+            progress.check()
+        # Prune with the tours of other processes too, which this one doesn't
+        # have the paths of
+        prune_cost = best_cost
+        if shared_cost is not None:
+            prune_cost = min(prune_cost, shared_cost.value)
+        if current_tree_node.bound >= prune_cost:
+            # Siblings are sorted, the rest of them can't do better either
+            stack[-1].clear()
+            continue
+
+        children = []
+        for child in tree.expand(current_tree_node):
+            if child.bound >= prune_cost:
+                continue  # Prune, can't beat the incumbent
+            if tree.is_complete(child):
+                # A complete tour cheaper than the incumbent
+                best_cost, best_path = int(child.bound), child.path[:-1]
+                prune_cost = best_cost
+                if progress is not None:
+                    progress.improve(best_cost, best_path)
+                if shared_cost is not None:
+                    with shared_lock:
+                        if best_cost < shared_cost.value:
+                            shared_cost.value = best_cost
+                continue
+            children.append(child)
+
+        if children:
+            children.sort(key=lambda tree_node: tree_node.bound, reverse=True)
+            stack.append(children)
+
+    return best_cost, best_path
+
+
+# Subtrees handed out per process by parallel_branch_and_bound()
+TASKS_PER_PROCESS = 8
+
+# Set up in each worker process of parallel_branch_and_bound()
+_worker_tree: SearchTree = None
+_worker_cost = None
+_worker_lock = None
+_worker_parent: int = None
+
+
+def _init_worker(cm, bound, init_node, shared_cost, shared_lock):
+    global _worker_tree, _worker_cost, _worker_lock, _worker_parent
+    _worker_tree = SearchTree(cm, bound=bound, init_node=init_node, stats={})
+    _worker_cost = shared_cost
+    _worker_lock = shared_lock
+    _worker_parent = os.getppid()
+
+
+def _exit_if_orphaned():
+    if os.getppid() != _worker_parent:
+        # The routing process was killed on timeout, don't outlive it
+        os._exit(0)
+
+
+def _search_subtree(tree_node: TreeNode):
+    """
+    Search one subtree in a worker process. Return the best tour found
+    (or None) and the number of tree nodes expanded.
+    """
+    _worker_tree.stats["expanded"] = 0
+    best_cost, best_path = depth_first(
+        _worker_tree,
+        [tree_node],
+        (float("inf"), None),
+        shared_cost=_worker_cost,
+        shared_lock=_worker_lock,
+        poll=_exit_if_orphaned,
+    )
+    return best_cost, best_path, _worker_tree.stats["expanded"]
+
+
+def parallel_branch_and_bound(
+    cm: CostMatrix,
+    processes: int = None,
+    incumbent: tuple[int, list[int]] = None,
+    bound: str = "reduce",
+    stats: dict = None,
+    progress: Progress = None,
+):
+    """
+    Find the optimal tour with branch and bound on several processes
+    (os.cpu_count() by default).
+
+    The top of the tree is expanded breadth first until there are about
+    TASKS_PER_PROCESS subtrees per process, and the subtrees are handed out
+    cheapest first to a process pool, one at a time, so that a process
+    done with a small subtree goes on to the next instead of sitting idle.
+    Each subtree is searched depth first, pruning with the cost of the best
+    tour found by any process, which is kept in shared memory. Tours are
+    reported to progress as the subtrees they are in are done.
+    """
+    if processes is None:
+        processes = os.cpu_count()
+    if incumbent is None:
+        incumbent = nearest_neighbor(cm)
+    best_cost, best_path = incumbent
+    if progress is not None:
+        progress.improve(best_cost, best_path)
+
+    tree = SearchTree(cm, bound=bound, stats=stats)
+    init_node = int(cm.node_of[tree.roots[0].path[0]])
+
+    # Split the tree into subtrees
+    subtrees = tree.roots
+    while subtrees and len(subtrees) < TASKS_PER_PROCESS * processes:
+        children = []
+        for tree_node in subtrees:
+            if progress is not None:
+                progress.check()
+            for child in tree.expand(tree_node):
+                if child.bound >= best_cost:
+                    continue  # Prune, can't beat the incumbent
+                if tree.is_complete(child):
+                    best_cost, best_path = int(child.bound), child.path[:-1]
+                    if progress is not None:
+                        progress.improve(best_cost, best_path)
+                    continue
+                children.append(child)
+        subtrees = children
+    subtrees = [t for t in subtrees if t.bound < best_cost]
+    subtrees.sort(key=lambda tree_node: tree_node.bound)
+
+    shared_cost = RawValue("d", best_cost)
+    shared_lock = Lock()
+    with Pool(
+        processes,
+        initializer=_init_worker,
+        initargs=(cm, bound, init_node, shared_cost, shared_lock),
+    ) as pool:
+        results = pool.imap_unordered(_search_subtree, subtrees)
+        while True:
+            try:
+                cost, path, expanded = results.next(timeout=POLL_INTERVAL)
+            except multiprocessing.TimeoutError:
+                if progress is not None:
+                    progress.check()  # Leaving the pool terminates the workers
+                continue
+            except StopIteration:
+                break
+            # Subtrees pruned by the tours of other processes have no tour
+            if path is not None and cost < best_cost:
+                best_cost, best_path = int(cost), path
+                if progress is not None:
+                    progress.improve(best_cost, best_path)
+            if stats is not None:
+                stats["expanded"] = stats.get("expanded", 0) + expanded
+
+    return best_cost, best_path
+
+
+def beam_search(
+    cm: CostMatrix,
+    width: int = BEAM_WIDTH,
+    incumbent: tuple[int, list[int]] = None,
+    bound: str = "reduce",
+    stats: dict = None,
+    progress: Progress = None,
+):
+    """
+    Find a good tour with beam search over the branch and bound tree.
+
+    The tree is walked one depth at a time, and only the width tree nodes
+    with the lowest bounds are kept at each depth, so a search takes
+    O(width * N) tree node expansions whatever the order looks like. The
+    result is not guaranteed to be optimal, but it is never worse than the
+    incumbent, which defaults to the nearest neighbor tour. Every incumbent
+    is reported to progress, which is checked before every expansion.
+    """
+    if incumbent is None:
+        incumbent = nearest_neighbor(cm)
+    best_cost, best_path = incumbent
+    if progress is not None:
+        progress.improve(best_cost, best_path)
+
+    # Tours are built from the start node, which nodes[0] is in _find_route()
+    tree = SearchTree(cm, bound=bound, init_node=0, stats=stats)
+    level = tree.roots
+
+    while level:
+        children = []
+        for tree_node in level:
+            if progress is not None:
+                progress.check()
+            for child in tree.expand(tree_node):
+                if child.bound >= best_cost:
+                    continue  # Prune, can't beat the incumbent
+                if tree.is_complete(child):
+                    # A complete tour cheaper than the incumbent
+                    best_cost, best_path = int(child.bound), child.path[:-1]
+                    if progress is not None:
+                        progress.improve(best_cost, best_path)
+                    continue
+                children.append(child)
+
+        # Tree nodes that visited the same nodes and stopped at the same AP
+        # have the same tours ahead of them, only keep the cheapest
+        children.sort(key=lambda tree_node: tree_node.bound)
+        level = []
+        seen = set()
+        for child in children:
+            key = (frozenset(cm.node_of[child.path].tolist()), child.path[-1])
+            if key not in seen:
+                seen.add(key)
+                level.append(child)
+                if len(level) == width:
+                    break  # Keep the most promising tree nodes for the next depth
+
+    return best_cost, best_path
+
+
+# Numeric kernels and their signatures. They are compiled ahead of time by
+# build_kernels.py, or else just in time by numba if it is installed.
+KERNELS = {
+    "reduce_matrix": "Tuple((f8[:, :], f8, f8[:], f8[:]))(f8[:, :])",
+    "assignment_cost": "f8(f8[:, :])",
+}
+
+_compiled_kernels = {}
+
+
+def compiled(f):
+    """
+    Return the compiled version of a kernel: from the ahead-of-time built
+    module if there is one, or compiled with numba if it is installed, with
+    the machine code cached on disk so that new processes don't compile it
+    again. Falls back to f itself.
+    """
+    if f.__name__ in _compiled_kernels:
+        return _compiled_kernels[f.__name__]
 
+    try:
+        from . import _kernels
+
+        f_compiled = getattr(_kernels, f.__name__)
+    except (ImportError, AttributeError):
+        try:
+            from numba import jit
+
+            try:
+                f_compiled = jit(nopython=True, cache=True)(f)
+            except RuntimeError:
+                # No place to cache, e.g. when running from a frozen build
+                f_compiled = jit(nopython=True)(f)
+            # print("Using Numba JIT to improve BnB performance. ")
+        except ModuleNotFoundError:
+            # print("Numba not found. Running BnB with native CPython. ")
+            f_compiled = f
+
+    _compiled_kernels[f.__name__] = f_compiled
+    return f_compiled
+
+
+def warm_up():
+    """
+    Compile (or load) all kernels, so that the first order routed doesn't
+    pay for it. Processes forked afterwards inherit the compiled kernels.
+    """
+    mat = np.zeros((4, 4))
+    for name in KERNELS:
+        compiled(globals()[name])(mat.copy())
+
+
+def setup_matrix(cm: CostMatrix):
+    """
+    Lay the cost matrix out with 4 rows/columns per node (N-E-S-W), filling
+    the rows/columns of missing APs with infinity. Return the matrix and the
+    row/column number of each AP in cm.
+    """
     # Multi Access
     # Initialize matrix and fill with infinite
-    mat_size = len(nodes * 4)
+    mat_size = cm.node_count * 4
     mat = np.full(shape=(mat_size, mat_size), fill_value=float("inf"))
-    dict_ap_to_idx = {}  # Save mapping of APs -> row/col numbers.
-
-    # Process item nodes
-    for node in nodes:
-        node_idx = nodes.index(node)
-        rows_range = range(node_idx * 4, node_idx * 4 + 4)
-        for r in rows_range:
-            curr_ap = node.aps_all[r % 4]
-            if curr_ap:  # Continue if current AP exists
-                dict_ap_to_idx[curr_ap] = r  # Record this AP's row number for later use
+    ap_to_idx = cm.node_of * 4 + cm.slot  # Save mapping of APs -> row/col numbers.
 
-                for c in range(0, mat_size):
-                    dest_node = nodes[floor(c / 4)]
-                    dest_ap = dest_node.aps_all[c % 4]
+    costs = cm.mat.astype(np.float64)
+    costs[cm.mat >= INF] = float("inf")
+    mat[np.ix_(ap_to_idx, ap_to_idx)] = costs
 
-                    if (
-                        node is not dest_node and dest_ap
-                    ):  # Set grid to cost if destination AP exists
-                        mat[r][c] = curr_ap.dv[dest_ap][0]
-                        # print(f"({r},{c}) <== {mat[r][c]} ({dest_node.coord})")
-
-    return mat, dict_ap_to_idx
+    return mat, ap_to_idx
 
 
 def reduce_matrix(mat: np.ndarray):
+    """
+    Reduce the matrix in place, node by node (4 rows/columns at a time).
+    Return the matrix, the total reduced cost, and how much each node's
+    rows and columns were reduced by.
+    """
     mat_size = mat.shape[0]
+    row_reduced = np.zeros(int(mat_size / 4))
+    col_reduced = np.zeros(int(mat_size / 4))
 
     # Reduce by row
     row_reduce_costs = 0
     for i in range(int(mat_size / 4)):
-        row_reduced = mat[i * 4 : i * 4 + 4, :].min()
-        if row_reduced != np.inf:
-            row_reduce_costs += row_reduced
-            mat[i * 4 : i * 4 + 4, :] -= row_reduced
+        row_reduced[i] = mat[i * 4 : i * 4 + 4, :].min()
+        if row_reduced[i] != np.inf:
+            row_reduce_costs += row_reduced[i]
+            mat[i * 4 : i * 4 + 4, :] -= row_reduced[i]
+        else:
+            row_reduced[i] = 0
 
     col_reduce_costs = 0
     for i in range(int(mat_size / 4)):
-        col_reduced = mat[:, i * 4 : i * 4 + 4].min()
-        if col_reduced != np.inf:
-            col_reduce_costs += col_reduced
-            mat[:, i * 4 : i * 4 + 4] -= col_reduced
+        col_reduced[i] = mat[:, i * 4 : i * 4 + 4].min()
+        if col_reduced[i] != np.inf:
+            col_reduce_costs += col_reduced[i]
+            mat[:, i * 4 : i * 4 + 4] -= col_reduced[i]
+        else:
+            col_reduced[i] = 0
 
     total_cost = row_reduce_costs + col_reduce_costs
     # print(f"Finished reducing matrix. Cost = {total_cost}")
     # print_matrix(compress_minimum_matrix(mat))
-    return mat, total_cost
+    return mat, total_cost, row_reduced, col_reduced
+
+
+def assignment_cost(mat: np.ndarray) -> float:
+    """
+    Return the cost of the cheapest assignment of rows to columns of a
+    square matrix (Hungarian method, O(n^3)), or infinity if every
+    assignment uses an infinite entry.
+    """
+    n = mat.shape[0]
+    # Potentials of rows/columns, and the row assigned to each column.
+    # Column 0 is a dummy that the row being added starts from.
+    u = np.zeros(n + 1)
+    v = np.zeros(n + 1)
+    row_of = np.zeros(n + 1, dtype=np.int64)
+    way = np.zeros(n + 1, dtype=np.int64)
+
+    for i in range(1, n + 1):
+        row_of[0] = i
+        j0 = 0
+        min_slack = np.full(n + 1, np.inf)
+        used = np.zeros(n + 1, dtype=np.bool_)
+        while True:
+            # Grow the alternating tree by the column with the least slack
+            used[j0] = True
+            i0 = row_of[j0]
+            delta = np.inf
+            j1 = 0
+            for j in range(1, n + 1):
+                if not used[j]:
+                    slack = mat[i0 - 1, j - 1] - u[i0] - v[j]
+                    if slack < min_slack[j]:
+                        min_slack[j] = slack
+                        way[j] = j0
+                    if min_slack[j] < delta:
+                        delta = min_slack[j]
+                        j1 = j
+            if delta == np.inf:
+                return np.inf  # Row i can't be assigned
+
+            for j in range(n + 1):
+                if used[j]:
+                    u[row_of[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_slack[j] -= delta
+            j0 = j1
+            if row_of[j0] == 0:
+                break
+
+        # Flip the augmenting path
+        while j0 != 0:
+            j1 = way[j0]
+            row_of[j0] = row_of[j1]
+            j0 = j1
+
+    total_cost = 0.0
+    for j in range(1, n + 1):
+        total_cost += mat[row_of[j] - 1, j - 1]
+    return total_cost
 
 
 def print_matrix(mat):
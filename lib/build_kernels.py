@@ -0,0 +1,24 @@
+import os
+from numba.pycc import CC
+from .bnb import KERNELS
+from . import bnb
+
+"""
+Compile the numeric kernels ahead of time into lib/_kernels, an extension
+module that is used instead of compiling them at runtime, and is shipped
+by the PyInstaller build. Run again after changing a kernel:
+
+    $ python -m lib.build_kernels
+"""
+
+
+def build_kernels():
+    cc = CC("_kernels")
+    cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+    for name, signature in KERNELS.items():
+        cc.export(name, signature)(getattr(bnb, name))
+    cc.compile()
+
+
+if __name__ == "__main__":
+    build_kernels()
@@ -1,9 +1,12 @@
 # Resolves class type hinting itself, see https://stackoverflow.com/a/33533514
 from __future__ import annotations
 import csv
-from math import floor
 import os
 import heapq
+import numpy as np
+from .grid import Grid
+from .products import ProductDB
+from .table import PathTable, Trace, load_path_table
 
 """ Configuration Constants """
 # Initializes the map with specific size
@@ -35,6 +38,14 @@ class PriorityQueue:
             raise IndexError("Priority queue is empty")
         priority1, _, _, item = heapq.heappop(self._queue)
         return priority1, item
+
+    def drain(self):
+        """
+        Remove all items and return them, in no particular order
+        """
+        items = [entry[-1] for entry in self._queue]
+        self._queue = []
+        return items
     
 class AccessPoint:
     def __init__(self, coord: tuple[int, int], parent: Node) -> None:
@@ -42,18 +53,22 @@ class AccessPoint:
         self.parent = parent  # Pointer to parent node
         self.dv = dict()  # Initialize distance vector
 
-    def add_path(
-        self, destination: AccessPoint, distance: int, path: list[tuple[int, int]]
-    ) -> None:
+    def add_path(self, destination: AccessPoint, distance: int, path: Trace) -> None:
         """
         Add a path to the distance vector. The path goes from this AP
         to another AP with a tuple containing the path's distance and
-        grid-by-grid path to take
+        a handle to the grid-by-grid path to take
         """
         self.dv[destination] = (distance, path)
-        destination.dv[self] = (distance, path[::-1])
+        destination.dv[self] = (distance, path.reversed())
+
+    def path_to(self, destination: AccessPoint) -> list[tuple[int, int]]:
+        """
+        Return the grid-by-grid path to another AP in the distance vector
+        """
+        return self.dv[destination][1].path(self.parent._map)
 
-    def get_nearest_ap(self) -> tuple[int, list[tuple[int, int]]]:
+    def get_nearest_ap(self) -> tuple[AccessPoint, tuple[int, Trace]]:
         """
         Return the nearest AP stored in the current AP's distance vector
         """
@@ -75,7 +90,7 @@ class Node:
     documentation for usage.
     """
 
-    def __init__(self, id: list, coord: tuple[int, int], map) -> None:
+    def __init__(self, id: list, coord: tuple[int, int], map: Grid) -> None:
         self.id, self.coord = id, coord
 
         # The product's neighbors; initialized with empty elements and will be updated later
@@ -84,7 +99,7 @@ class Node:
         self._map = map
 
         # Detect valid neighbors (access points)
-        aps = get_aps(self._map, self.coord)
+        aps = self._map.neighbors(self.coord)
         # Assign each neighbor to a direction (n/s/e/w)
         for direction, ap in aps:
             match direction:
@@ -172,8 +187,14 @@ class Config:
         start_position=(0, 0),
         end_position=(0, 0),
         default_timeout_value=60,
+        beam_width=32,  # tree nodes kept per depth by beam search
+        bound="reduce",  # lower bound of branch and bound/beam search
+        memory_budget=2048,  # MiB of RAM a solver process may use
+        islands=1,  # populations of the genetic algorithm, one per process
+        migration_interval=50,  # genetic algorithm rounds between migrations
         map_data=None,
         prod_db=None,
+        path_table=None,
     ) -> None:
         self.use_random_item = use_random_item
         self.save_instructions = save_instructions
@@ -181,57 +202,99 @@ class Config:
         self.start_position = start_position
         self.end_position = end_position
         self.default_timeout_value = default_timeout_value
-        self.map_data = map_data
-        self.prod_db = prod_db
+        self.beam_width = beam_width
+        self.bound = bound
+        self.memory_budget = memory_budget
+        self.islands = islands
+        self.migration_interval = migration_interval
+        self.map_data: Grid = map_data
+        self.prod_db: ProductDB = prod_db
+        self.path_table: PathTable = path_table
+
+
+def load_inventory_arrays(
+    file_path: str, snapshot: bool = True
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parse the inventory dataset into arrays of product ids, X and Y.
+
+    If snapshot is set, the arrays are also saved to <file_path>.npz and
+    loaded from there by later calls, as long as the size and modification
+    time of the dataset file have not changed.
+    """
+    stat = os.stat(file_path)
+    stamp = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    snapshot_path = f"{file_path}.npz"
+
+    if snapshot:
+        try:
+            with np.load(snapshot_path) as data:
+                if np.array_equal(data["stamp"], stamp):
+                    return data["id"], data["x"], data["y"]
+        except (OSError, KeyError, ValueError):
+            pass  # No usable snapshot, parse the dataset file instead
+
+    data = np.loadtxt(
+        file_path,
+        delimiter="\t",
+        skiprows=1,  # Skip the table header
+        ndmin=1,
+        dtype=[("id", np.int64), ("x", np.float64), ("y", np.float64)],
+    )
+    id = data["id"]
+    col = np.floor(data["x"]).astype(np.int32)  # Drop the decimals in xLocation
+    row = data["y"].astype(np.int32)
+
+    if snapshot:
+        try:
+            # Write to a temporary file first so that no one reads a partial snapshot
+            tmp_path = f"{snapshot_path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp_path, stamp=stamp, id=id, x=col, y=row)
+            os.replace(tmp_path, snapshot_path)
+        except OSError:
+            pass  # Not being able to snapshot is not an error, e.g. read-only data
+
+    return id, col, row
 
 
 # Read data from the file
-def read_inventory_data(file_path: str, conf: Config) -> tuple[list[list[int]], dict[tuple]]:
+def read_inventory_data(file_path: str, conf: Config, snapshot: bool = True) -> None:
     """
     Input:
         file_path: Path to the inventory dataset file
+        snapshot: Whether to keep a binary snapshot of the dataset for
+                  faster loading, see load_inventory_arrays
 
     Output:
-        map_data: A 2D list describing the warehouse map.
-        prod_db: An dictionary; key is the product's id, and the value
-                 is a Prod instance describing that product
+        map_data: A Grid describing the warehouse map.
+        prod_db: A ProductDB; maps each product's id to the coordinate
+                 of its shelf
+        path_table: Distances and paths between all pairs of free grids
+                    on the map, see PathTable
     """
-    id = []
-    col = []
-    row = []
-
-    # Read data
-    with open(file_path) as csvfile:
-        reader = csv.reader(csvfile, delimiter="\t")
-        for curr in reader:  # For every data (row)
-            id.append(curr[0])
-            col.append(curr[1])
-            row.append(curr[2])
-
-    id, col, row = id[1:], col[1:], row[1:]  # Remove the table header
-    id = [int(i) for i in id]
-    col = [floor(float(a)) for a in col]  # Drop the decimals in xLocation
-    row = [int(b) for b in row]
+    id, col, row = load_inventory_arrays(file_path, snapshot=snapshot)
 
     # Product database
-    prod_db = dict()
+    prod_db = ProductDB(id, col, row)
 
-    # Initialize an empty map, it should be a 2-d list[40][21]
+    # Initialize an empty map, it should be a 2-d array[40][21]
     # Note: 0 - empty, 1 - shelf
     # Column - X, Row - Y, map[X][Y]
     cols, rows = DEFAULT_COLS, DEFAULT_ROWS
-    map_data = [[0] * rows for _ in range(cols)]
+    occupancy = np.zeros((cols, rows), dtype=np.int8)
+    occupancy[col, row] = 1  # Set all shelves to 1
 
-    for i, c, r in zip(id, col, row):
-        # Set all shelves to 1
-        map_data[c][r] = 1
-        prod_db[i] = (c, r)
+    map_data = Grid(occupancy)
 
     conf.map_data = map_data
     conf.prod_db = prod_db
+    # Precompute all pathfinding on the map once, so that routing an order
+    # only has to look distances up. The result is cached next to the data
+    # file and is rebuilt automatically once the map changes.
+    conf.path_table = load_path_table(map_data, cache_path=f"{file_path}.pathcache")
 
 
-def get_item(product_db: dict, id_list: list) -> list[tuple]:
+def get_item(product_db: ProductDB, id_list: list) -> list[tuple]:
     prod_list = []
     for id in id_list:
         try:
@@ -254,27 +317,12 @@ def read_order_file(file_path):
                 id += 1
     return order_list
 
-def is_valid(map, coord):
+def is_valid(map: Grid, coord):
     valid = True
-    if coord[0] not in range(len(map)) or coord[1] not in range(len(map[0])):
+    if not map.in_bounds(coord):
         print("Coordinate exceeds the range of map ")
         valid = False
-    elif map[coord[0]][coord[1]] == 1:
+    elif map.is_shelf(coord):
         print(f"Position {coord} is a shelf ")
         valid = False
     return valid
-
-def get_aps(map, node: tuple) -> list[tuple[tuple, tuple]]:
-    aps = []  # list record dir and ap coord
-    directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]
-    row, col = len(map), len(map[0])
-    for direction in directions:
-        d_x, d_y = direction
-        neighbor = (node[0] + d_x, node[1] + d_y)
-        if (
-            neighbor[0] in range(row)
-            and neighbor[1] in range(col)
-            and map[neighbor[0]][neighbor[1]] == 0
-        ):
-            aps.append((direction, neighbor))
-    return aps
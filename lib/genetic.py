@@ -1,101 +1,372 @@
-from random import sample, randint, choice, random
-from .core import Node, AccessPoint, SingleNode
+import numpy as np
+from random import getrandbits
+from multiprocessing import Pool
+import multiprocessing
+import os
+from .core import Config
+from .matrix import CostMatrix
+from .anytime import POLL_INTERVAL, Progress
 
-MUTATION_RATE = 0.1
+"""
+Genetic algorithm over a population of tours kept in arrays
+"""
+
+# Chance that a child gets a part of its order of nodes reversed
+MUTATION_RATE = 0.3
+
+# Chance that a child picks another AP of a node, per node
+AP_MUTATION_RATE = 0.02
+
+# Individuals drawn per tournament when picking a parent
+TOURNAMENT_SIZE = 3
+
+# Smallest population, small orders have few tours but need some variety
+MIN_POPULATION = 100
+
+# Best individuals that go on to the next round as they are
+ELITES = 2
+
+# Rounds without a better tour after which the search stops
+STALL_ROUNDS = 1000
+
+# Rounds parallel_genetic() evolves the islands for between migrations, the
+# default of Config
+MIGRATION_INTERVAL = Config().migration_interval
+
+# Best individuals of an island that move to the next one at a migration
+MIGRANTS = 2
 
 
 def generate_population(
-    item_nodes: list[Node], size: int = 10
-) -> list[list[AccessPoint]]:
-    population = []
-    for i in range(size):
-        # Get a random access points of each node
-        aps = [choice(n.aps) for n in item_nodes]
-        population.append(sample(list(aps), k=len(aps)))
-
-    return population
-
-
-def gt_cost(
-    individual: list[AccessPoint],
-    start_node: SingleNode,
-    end_node: SingleNode,
-) -> float:
-    # Add start and end for individual path
-    full_path = start_node.aps + individual + end_node.aps
-
-    cost = 0
-    size = len(full_path)
-    for i in range(size):
-        curr, nxt = full_path[i], full_path[(i + 1) % size]
-        cost += curr.dv[nxt][0]
-    return cost
-
-
-def mutate(individual: list[AccessPoint]) -> list[AccessPoint]:
-    mutated_individual = individual.copy()
-    if random() < MUTATION_RATE:
-        size = len(individual)
-        # Generate 2 indexes and swap the elements
-        i, j = sample(range(size), k=2)
-        mutated_individual[i], mutated_individual[j] = (
-            mutated_individual[j],
-            mutated_individual[i],
-        )
+    cm: CostMatrix, size: int, rng: np.random.Generator
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return size random individuals. Individual i visits item node
+    order[i][p] + 1 p-th, and stops at AP choice[i][k] of item node k + 1.
+    """
+    items = cm.node_count - 2
+    order = rng.random((size, items)).argsort(axis=1)
+    choice = (rng.random((size, items)) * ap_counts(cm)).astype(np.int64)
+    return order, choice
 
-    return mutated_individual
 
+def ap_counts(cm: CostMatrix) -> np.ndarray:
+    """
+    Return the number of APs of every item node
+    """
+    return np.diff(cm.node_ptr)[1:-1]
 
-def crossover(
-    a: list[AccessPoint],
-    b: list[AccessPoint],
-) -> list[AccessPoint]:
-    size = len(a)
-    crossover_point = randint(0, size - 1)
-    a_parent = [ap.parent for ap in a[:crossover_point]]
-    b_parent = [ap.parent for ap in b[:crossover_point]]
-    child_a = a[:crossover_point] + [ap for ap in b if ap.parent not in a_parent]
-    child_b = b[:crossover_point] + [ap for ap in a if ap.parent not in b_parent]
 
-    return child_a, child_b
+def tour_aps(cm: CostMatrix, order: np.ndarray, choice: np.ndarray) -> np.ndarray:
+    """
+    Return the item APs every individual goes through, in order
+    """
+    return cm.node_ptr[1 + order] + np.take_along_axis(choice, order, axis=1)
 
 
-def genetic(
-    item_nodes, start_node, end_node, rounds=0
-) -> tuple[list[list[AccessPoint]], list[float]]:
-
-    # If only 1 node, return a path with the node
-    if len(item_nodes) == 1:
-        return (
-            gt_cost([item_nodes[0].aps[0]], start_node, end_node),
-            start_node.aps + [item_nodes[0].aps[0]] + end_node.aps,
+def population_cost(
+    cm: CostMatrix, order: np.ndarray, choice: np.ndarray
+) -> np.ndarray:
+    """
+    Return the cost of every individual's tour from start to end and back
+    """
+    aps = tour_aps(cm, order, choice)
+    mat = cm.mat.astype(np.int64)
+    return (
+        mat[cm.start, aps[:, 0]]
+        + mat[aps[:, :-1], aps[:, 1:]].sum(axis=1)
+        + mat[aps[:, -1], cm.end]
+        + mat[cm.end, cm.start]
+    )
+
+
+def to_path(cm: CostMatrix, order: np.ndarray, choice: np.ndarray) -> list[int]:
+    """
+    Return the tour of one individual as a path of AP indexes
+    """
+    aps = tour_aps(cm, order[None, :], choice[None, :])[0]
+    return [cm.start] + aps.tolist() + [cm.end]
+
+
+def from_path(cm: CostMatrix, path: list[int]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the individual of a tour given as a path of AP indexes
+    """
+    path = np.asarray(path)
+    path = np.roll(path, -int(np.flatnonzero(path == cm.start)[0]))
+    aps = path[~np.isin(path, [cm.start, cm.end])]
+    order = cm.node_of[aps].astype(np.int64) - 1
+    choice = np.empty(len(order), dtype=np.int64)
+    choice[order] = aps - cm.node_ptr[1 + order]
+    return order, choice
+
+
+def tournament(costs: np.ndarray, count: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Pick count individuals, each the cheapest of TOURNAMENT_SIZE random ones
+    """
+    drawn = rng.integers(0, len(costs), size=(count, TOURNAMENT_SIZE))
+    return drawn[np.arange(count), costs[drawn].argmin(axis=1)]
+
+
+def crossover(a: np.ndarray, b: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Order crossover of every pair of orders a[i], b[i]: the child keeps a
+    random slice of a in place, and gets the other nodes in the order they
+    come in b
+    """
+    size, items = a.shape
+    cuts = np.sort(rng.integers(0, items + 1, size=(size, 2)), axis=1)
+    cols = np.arange(items)
+    kept = (cols >= cuts[:, :1]) & (cols < cuts[:, 1:])
+
+    # Nodes in the slice of a, which are skipped in b
+    in_slice = np.zeros((size, items), dtype=bool)
+    in_slice[np.nonzero(kept)[0], a[kept]] = True
+    from_b = ~np.take_along_axis(in_slice, b, axis=1)
+
+    # Both masks have the same number of nodes in every row
+    child = a.copy()
+    child[~kept] = b[from_b]
+    return child
+
+
+def mutate(
+    cm: CostMatrix, order: np.ndarray, choice: np.ndarray, rng: np.random.Generator
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reverse a random part of some orders, and pick another AP for some nodes
+    """
+    size, items = order.shape
+    ends = np.sort(rng.integers(0, items, size=(size, 2)), axis=1)
+    ends[rng.random(size) >= MUTATION_RATE] = 0  # Reversing [0, 0] changes nothing
+    first, last = ends[:, :1], ends[:, 1:]
+    cols = np.arange(items)
+    reverse = (cols >= first) & (cols <= last)
+    order = np.take_along_axis(order, np.where(reverse, first + last - cols, cols), 1)
+
+    other = (rng.random((size, items)) * ap_counts(cm)).astype(np.int64)
+    choice = np.where(rng.random((size, items)) < AP_MUTATION_RATE, other, choice)
+    return order, choice
+
+
+def population_size(items: int) -> int:
+    # Keep population at a constant size
+    return max(MIN_POPULATION, int(items * (items - 1) / 2))
+
+
+def default_rounds(items: int) -> int:
+    return max(int((items**2) / 2), 100) * 10
+
+
+def best_tour(
+    cm: CostMatrix, order: np.ndarray, choice: np.ndarray
+) -> tuple[int, list[int]]:
+    """
+    Return the cost and path of the best tour in a population
+    """
+    costs = population_cost(cm, order, choice)
+    best = int(costs.argmin())
+    return int(costs[best]), to_path(cm, order[best], choice[best])
+
+
+def evolve(
+    cm: CostMatrix,
+    order: np.ndarray,
+    choice: np.ndarray,
+    rounds: int,
+    rng: np.random.Generator,
+    progress: Progress = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Evolve a population for a number of rounds, or until STALL_ROUNDS
+    rounds go by without a better tour, and return it.
+
+    Every round, the whole population is replaced by children of parents
+    picked by tournament, except for the ELITES best individuals. Children
+    get their order of nodes by order crossover and their APs from either
+    parent, then are mutated. Every better tour is reported to progress,
+    which is checked before every round.
+    """
+    size, items = order.shape
+    costs = population_cost(cm, order, choice)
+    best_cost = costs.min()
+
+    stall = 0
+    for r in range(rounds):
+        if progress is not None:
+            progress.check()
+
+        count = size - ELITES
+        parents_a = tournament(costs, count, rng)
+        parents_b = tournament(costs, count, rng)
+        child_order = crossover(order[parents_a], order[parents_b], rng)
+        child_choice = np.where(
+            rng.random((count, items)) < 0.5, choice[parents_a], choice[parents_b]
         )
+        child_order, child_choice = mutate(cm, child_order, child_choice, rng)
+
+        elites = np.argpartition(costs, ELITES - 1)[:ELITES]
+        order = np.concatenate([order[elites], child_order])
+        choice = np.concatenate([choice[elites], child_choice])
+        costs = population_cost(cm, order, choice)
 
-    # Keep population at a constant size (at least 2)
-    size = max(2, int(len(item_nodes) * (len(item_nodes) - 1) / 2))
+        best = int(costs.argmin())
+        if costs[best] < best_cost:
+            best_cost = costs[best]
+            if progress is not None:
+                path = to_path(cm, order[best], choice[best])
+                progress.improve(int(best_cost), path)
+            stall = 0
+        else:
+            stall += 1
+            if stall == STALL_ROUNDS:
+                break
+
+    return order, choice
+
+
+def genetic(
+    cm: CostMatrix,
+    rounds=0,
+    progress: Progress = None,
+    incumbent: tuple[int, list[int]] = None,
+) -> tuple[float, list[int]]:
+    """
+    Evolve a population of tours for a number of rounds (see evolve()), and
+    return the best. The population is kept in arrays, so a round is a few
+    array operations on all individuals at once.
+
+    incumbent is the (cost, path) of a known tour, which joins the first
+    population. Every better tour is reported to progress.
+    """
+    items = cm.node_count - 2  # Nodes other than start and end
+    if items == 0:
+        path = [cm.start, cm.end]
+        return cm.tour_cost(path), path
 
     if rounds == 0:
-        rounds = max(int((len(item_nodes) ** 2) / 2), 100)
+        rounds = default_rounds(items)
 
-    population = generate_population(item_nodes, size=size)
+    rng = np.random.default_rng(getrandbits(64))
+    order, choice = generate_population(cm, population_size(items), rng)
+    if incumbent is not None:
+        order[0], choice[0] = from_path(cm, incumbent[1])
+    if progress is not None:
+        progress.improve(*best_tour(cm, order, choice))
 
-    for r in range(rounds):
-        for _ in range(int(size / 2)):
-            population.sort(
-                key=lambda individual: gt_cost(individual, start_node, end_node)
+    order, choice = evolve(cm, order, choice, rounds, rng, progress)
+    return best_tour(cm, order, choice)
+
+
+def migrate(cm: CostMatrix, islands: list[tuple[np.ndarray, np.ndarray]]):
+    """
+    Replace the MIGRANTS worst individuals of every island with copies of
+    the best ones of the island before it
+    """
+    ranks = [population_cost(cm, order, choice).argsort() for order, choice in islands]
+    migrants = [
+        (order[rank[:MIGRANTS]].copy(), choice[rank[:MIGRANTS]].copy())
+        for (order, choice), rank in zip(islands, ranks)
+    ]
+    for i, (order, choice) in enumerate(islands):
+        worst = ranks[i][-MIGRANTS:]
+        order[worst], choice[worst] = migrants[i - 1]
+
+
+# Set up in each worker process of parallel_genetic()
+_island_cm: CostMatrix = None
+
+
+def _init_island(cm):
+    global _island_cm
+    _island_cm = cm
+
+
+def _evolve_island(island):
+    """
+    Evolve one island in a worker process, and return it with its random
+    generator, which has moved on
+    """
+    order, choice, rng, rounds = island
+    order, choice = evolve(_island_cm, order, choice, rounds, rng)
+    return order, choice, rng
+
+
+def parallel_genetic(
+    cm: CostMatrix,
+    islands: int = None,
+    migration_interval: int = MIGRATION_INTERVAL,
+    rounds=0,
+    progress: Progress = None,
+    incumbent: tuple[int, list[int]] = None,
+) -> tuple[float, list[int]]:
+    """
+    Island model genetic algorithm: evolve several populations (os.cpu_count()
+    by default), each with a random generator of its own, on a process pool,
+    and return the best tour of all of them.
+
+    The islands are evolved migration_interval rounds at a time, and then
+    exchange their best individuals (see migrate()). Stops after rounds
+    rounds, or when no island has found a better tour for STALL_ROUNDS
+    rounds. incumbent joins the first island. The best tour of all islands
+    is reported to progress after every migration, and progress is checked
+    while waiting for the islands.
+    """
+    if islands is None:
+        islands = os.cpu_count()
+    items = cm.node_count - 2  # Nodes other than start and end
+    if items == 0 or islands <= 1:
+        return genetic(cm, rounds, progress, incumbent)
+
+    if rounds == 0:
+        rounds = default_rounds(items)
+
+    rngs = [
+        np.random.default_rng(seed)
+        for seed in np.random.SeedSequence(getrandbits(64)).spawn(islands)
+    ]
+    population = [
+        generate_population(cm, population_size(items), rng) for rng in rngs
+    ]
+    if incumbent is not None:
+        order, choice = population[0]
+        order[0], choice[0] = from_path(cm, incumbent[1])
+
+    best_cost, best_path = min(best_tour(cm, *island) for island in population)
+    if progress is not None:
+        progress.improve(best_cost, best_path)
+
+    stall = 0
+    with Pool(islands, initializer=_init_island, initargs=(cm,)) as pool:
+        for done in range(0, rounds, migration_interval):
+            interval = min(migration_interval, rounds - done)
+            results = pool.map_async(
+                _evolve_island,
+                [(*island, rng, interval) for island, rng in zip(population, rngs)],
             )
-            [parent_a, parent_b] = population[:2]
-            child_a, child_b = crossover(parent_a, parent_b)
-            mutated_child_a = mutate(child_a)
-            mutated_child_b = mutate(child_b)
-            population.extend([mutated_child_a, mutated_child_b])
-
-        population.sort(
-            key=lambda individual: gt_cost(individual, start_node, end_node)
-        )
-        population = population[:size]
+            while True:
+                try:
+                    evolved = results.get(timeout=POLL_INTERVAL)
+                    break
+                except multiprocessing.TimeoutError:
+                    if progress is not None:
+                        progress.check()  # Leaving the pool terminates the workers
 
-    return (
-        gt_cost(population[0], start_node, end_node),
-        start_node.aps + population[0] + end_node.aps,
-    )
+            population = [(order, choice) for order, choice, _rng in evolved]
+            rngs = [rng for _order, _choice, rng in evolved]
+
+            cost, path = min(best_tour(cm, *island) for island in population)
+            if cost < best_cost:
+                best_cost, best_path = cost, path
+                if progress is not None:
+                    progress.improve(best_cost, best_path)
+                stall = 0
+            else:
+                stall += interval
+                if stall >= STALL_ROUNDS:
+                    break
+
+            migrate(cm, population)
+
+    return best_cost, best_path
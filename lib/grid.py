@@ -0,0 +1,95 @@
+from __future__ import annotations
+from hashlib import sha1
+import numpy as np
+
+"""
+Occupancy grid of the warehouse map
+"""
+
+# Order in which neighbors are listed; searches break ties in this order
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+# Grids created in this process, by fingerprint
+_grids: dict[str, "Grid"] = dict()
+
+
+class Grid:
+    """
+    The warehouse map as a NumPy occupancy array, occupancy[X][Y] being
+    0 for an empty grid and 1 for a shelf.
+
+    Free grids are numbered in coordinate order (by X, then Y). Their
+    neighbors are kept in a CSR-style table: the neighbors of free grid i
+    are neighbor_idx[indptr[i]:indptr[i + 1]], reached by stepping in
+    DIRECTIONS[neighbor_dir[...]]. neighbors() serves the same information
+    as coordinate tuples for any grid, shelves included, so that searches
+    written in Python do no neighbor discovery of their own.
+    """
+
+    def __init__(self, occupancy: np.ndarray) -> None:
+        self.occupancy = np.asarray(occupancy, dtype=np.int8)
+        self.cols, self.rows = self.occupancy.shape
+        self.fingerprint = sha1(self.occupancy.tobytes()).hexdigest()
+        _grids.setdefault(self.fingerprint, self)
+
+        free = self.occupancy == 0
+        self.coords = np.argwhere(free)
+        self.cell_index = np.full((self.cols, self.rows), -1, dtype=np.int32)
+        self.cell_index[free] = np.arange(len(self.coords))
+
+        # Whether the neighbor of every grid in every direction is an empty grid
+        xs, ys = np.indices((self.cols, self.rows))
+        open_dir = np.zeros((self.cols, self.rows, len(DIRECTIONS)), dtype=bool)
+        for k, (d_x, d_y) in enumerate(DIRECTIONS):
+            n_x, n_y = xs + d_x, ys + d_y
+            inside = (n_x >= 0) & (n_x < self.cols) & (n_y >= 0) & (n_y < self.rows)
+            open_dir[inside, k] = free[n_x[inside], n_y[inside]]
+
+        # CSR neighbor table of the free grids
+        free_open = open_dir[free]
+        self.indptr = np.zeros(len(self.coords) + 1, dtype=np.int32)
+        self.indptr[1:] = np.cumsum(free_open.sum(axis=1))
+        src, self.neighbor_dir = np.nonzero(free_open)
+        steps = np.array(DIRECTIONS)[self.neighbor_dir]
+        self.neighbor_idx = self.cell_index[
+            self.coords[src, 0] + steps[:, 0], self.coords[src, 1] + steps[:, 1]
+        ]
+        self.neighbor_dir = self.neighbor_dir.astype(np.int8)
+
+        self._neighbors = [
+            [
+                [
+                    (direction, (x + direction[0], y + direction[1]))
+                    for k, direction in enumerate(DIRECTIONS)
+                    if open_dir[x, y, k]
+                ]
+                for y in range(self.rows)
+            ]
+            for x in range(self.cols)
+        ]
+
+    def __reduce__(self):
+        # Everything else is derived, no need to send it to other processes
+        return shared_grid, (self.occupancy,)
+
+    def in_bounds(self, coord: tuple[int, int]) -> bool:
+        return 0 <= coord[0] < self.cols and 0 <= coord[1] < self.rows
+
+    def is_shelf(self, coord: tuple[int, int]) -> bool:
+        return self.occupancy[coord[0], coord[1]] == 1
+
+    def neighbors(self, coord: tuple[int, int]) -> list[tuple[tuple, tuple]]:
+        """
+        Return (direction, coordinate) of the empty grids next to a grid
+        """
+        return self._neighbors[coord[0]][coord[1]]
+
+
+def shared_grid(occupancy: np.ndarray) -> Grid:
+    """
+    Return the grid of an occupancy array, reusing the one already created
+    in this process if any, e.g. when unpickling a map sent to a worker
+    """
+    occupancy = np.asarray(occupancy, dtype=np.int8)
+    grid = _grids.get(sha1(occupancy.tobytes()).hexdigest())
+    return grid if grid is not None else Grid(occupancy)
@@ -0,0 +1,91 @@
+import numpy as np
+from .matrix import CostMatrix, INF
+from .anytime import Progress
+
+"""
+Held-Karp dynamic programming
+"""
+
+# Most item nodes held_karp() takes, its tables double with every one more
+MAX_ITEMS = 18
+
+
+def popcounts(size: int) -> np.ndarray:
+    """
+    Return the number of bits set in every mask from 0 to 2^size - 1
+    """
+    masks = np.arange(1 << size)
+    counts = np.zeros(1 << size, dtype=np.int8)
+    for bit in range(size):
+        counts += (masks >> bit) & 1
+    return counts
+
+
+def held_karp(cm: CostMatrix, progress: Progress = None) -> tuple[int, list[int]]:
+    """
+    Find the optimal tour from the start node through all item nodes to the
+    end node, by dynamic programming over (set of item nodes visited, AP
+    the route stopped at).
+
+    dp[mask][a] is the cost of the cheapest route that leaves the start AP,
+    visits exactly the item nodes in mask and stops at item AP a. All masks
+    with the same number of items are computed at once with NumPy, one item
+    node at a time. Takes O(2^K * A^2) time and O(2^K * A) memory for K
+    item nodes with A APs in total, so ValueError is raised for more than
+    MAX_ITEMS item nodes. progress is checked between numbers of items;
+    there is no tour to report until the end.
+    """
+    # Item nodes are the ones between the start and the end node
+    items = range(1, cm.node_count - 1)
+    if len(items) > MAX_ITEMS:
+        raise ValueError(
+            f"Held-Karp takes at most {MAX_ITEMS} shelves, not {len(items)}"
+        )
+    if len(items) == 0:
+        path = [cm.start, cm.end]
+        return cm.tour_cost(path), path
+
+    # Item APs, and the item (bit in the masks) each of them belongs to
+    aps = np.arange(cm.node_ptr[items[0]], cm.node_ptr[items[-1] + 1])
+    item_of = cm.node_of[aps] - items[0]
+    ptr = cm.node_ptr[items[0] : items[-1] + 2] - cm.node_ptr[items[0]]
+    costs = cm.mat[np.ix_(aps, aps)]
+
+    size = len(items)
+    full = (1 << size) - 1
+    dp = np.full((1 << size, len(aps)), INF, dtype=np.int32)
+    pred = np.zeros((1 << size, len(aps)), dtype=np.int16)  # AP stopped at before
+    for k in range(size):
+        dp[1 << k, ptr[k] : ptr[k + 1]] = cm.mat[cm.start, aps[ptr[k] : ptr[k + 1]]]
+
+    counts = popcounts(size)
+    masks = np.arange(1 << size)
+    for count in range(2, size + 1):
+        if progress is not None:
+            progress.check()
+        layer = masks[counts == count]
+        for k in range(size):
+            # Routes that stop at item k, coming from the rest of the mask
+            to_k = layer[(layer >> k) & 1 == 1]
+            cand = (
+                dp[to_k ^ (1 << k)][:, :, None]
+                + costs[None, :, ptr[k] : ptr[k + 1]]
+            )
+            dp[to_k, ptr[k] : ptr[k + 1]] = np.minimum(cand.min(axis=1), INF)
+            pred[to_k, ptr[k] : ptr[k + 1]] = cand.argmin(axis=1)
+
+    # Go on to the end AP, which returns to the start for free
+    total = dp[full].astype(np.int64) + cm.mat[aps, cm.end]
+    last = int(total.argmin())
+
+    # Walk the predecessors back
+    route = [last]
+    mask = full
+    while counts[mask] > 1:
+        prev = int(pred[mask, last])
+        mask ^= 1 << int(item_of[last])
+        last = prev
+        route.append(last)
+
+    path = [cm.start] + aps[route[::-1]].tolist() + [cm.end]
+    return cm.tour_cost(path), path
@@ -0,0 +1,213 @@
+import numpy as np
+from time import time
+from .matrix import CostMatrix, INF
+
+"""
+Local search on the tours found by the routing algorithms
+"""
+
+# Seconds local_search() may take by default
+LOCAL_SEARCH_TIME = 0.5
+
+# Most of a timeout kept for local_search() after the routing algorithm
+LOCAL_SEARCH_SHARE = 0.1
+
+# Longest segment of nodes Or-opt moves at once
+SEGMENT_LENGTH = 3
+
+
+def node_aps_table(cm: CostMatrix) -> np.ndarray:
+    """
+    Return the APs of the node of every AP as rows of an (APs x 4) array,
+    padded with len(cm), a dummy AP that costs more than INF to go to or from
+    """
+    table = np.full((cm.node_count, 4), len(cm), dtype=np.int64)
+    for k in range(cm.node_count):
+        aps = cm.node_aps(k)
+        table[k, : len(aps)] = aps
+    return table[cm.node_of]
+
+
+def padded_matrix(cm: CostMatrix) -> np.ndarray:
+    """
+    Return the cost matrix as int64, with a row and column for the dummy AP
+    """
+    mat = np.full((len(cm) + 1, len(cm) + 1), 2 * INF, dtype=np.int64)
+    mat[:-1, :-1] = cm.mat
+    return mat
+
+
+def via(
+    mat: np.ndarray, aps: np.ndarray, prev: np.ndarray, next: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    For a node with APs aps[...] put between APs prev[...] and next[...],
+    return the cost of going through its best AP and that AP
+    """
+    costs = mat[prev[..., None], aps] + mat[aps, next[..., None]]
+    best = costs.argmin(axis=-1)[..., None]
+    return (
+        np.take_along_axis(costs, best, axis=-1)[..., 0],
+        np.take_along_axis(aps, best, axis=-1)[..., 0],
+    )
+
+
+def choose_aps(mat: np.ndarray, table: np.ndarray, tour: np.ndarray) -> np.ndarray:
+    """
+    Return tour with the best AP of every item node for the same order of
+    nodes, by dynamic programming over the nodes in order. tour starts with
+    the start AP and ends with the end AP, which stay.
+    """
+    layers = table[tour[1:-1]]  # APs of every item node, in order
+    cost = mat[tour[0], layers[0]]
+    prev = []
+    for k in range(1, len(layers)):
+        cand = cost[:, None] + mat[np.ix_(layers[k - 1], layers[k])]
+        prev.append(cand.argmin(axis=0))
+        cost = cand.min(axis=0)
+    last = int((cost + mat[layers[-1], tour[-1]]).argmin())
+
+    # Walk the choices back
+    choice = [last]
+    for k in range(len(prev) - 1, -1, -1):
+        choice.append(int(prev[k][choice[-1]]))
+    choice.reverse()
+    return np.concatenate(
+        [tour[:1], layers[np.arange(len(layers)), choice], tour[-1:]]
+    )
+
+
+def best_move(mat: np.ndarray, table: np.ndarray, tour: np.ndarray):
+    """
+    Return the change of cost of the best 2-opt, Or-opt or exchange move on
+    tour, and the tour after it. Nodes that get new neighbors on both sides
+    while their own neighbors stay where they are go through their best AP.
+    """
+    n = len(tour) - 2  # Item nodes, at positions 1 to n
+    a = tour
+    nodes = table[a]  # APs of the node at every position
+    best = (0, None)
+
+    # 2-opt: reverse positions i to j
+    i, j = np.triu_indices(n, k=1)
+    i, j = i + 1, j + 1
+    fixed = (
+        mat[a[i - 1], a[j]] + mat[a[i], a[j + 1]]
+        - mat[a[i - 1], a[i]] - mat[a[j], a[j + 1]]
+    )
+    # Unless i and j end up next to each other, both go through their best AP
+    via_j, ap_j = via(mat, nodes[j], a[i - 1], a[j - 1])
+    via_i, ap_i = via(mat, nodes[i], a[i + 1], a[j + 1])
+    moved = via_j + via_i - (
+        mat[a[i - 1], a[i]] + mat[a[i], a[i + 1]]
+        + mat[a[j - 1], a[j]] + mat[a[j], a[j + 1]]
+    )
+    delta = np.where(j > i + 1, np.minimum(moved, fixed), fixed)
+    if len(delta) and delta.min() < best[0]:
+        m = int(delta.argmin())
+        mi, mj = i[m], j[m]
+        new = np.concatenate([a[:mi], a[mi : mj + 1][::-1], a[mj + 1 :]])
+        if mj > mi + 1 and moved[m] < fixed[m]:
+            new[mi], new[mj] = ap_j[m], ap_i[m]
+        best = (int(delta[m]), new)
+
+    # Exchange the nodes at positions i and j, not next to each other
+    i, j = np.triu_indices(n, k=2)
+    i, j = i + 1, j + 1
+    via_i, ap_i = via(mat, nodes[i], a[j - 1], a[j + 1])
+    via_j, ap_j = via(mat, nodes[j], a[i - 1], a[i + 1])
+    delta = via_i + via_j - (
+        mat[a[i - 1], a[i]] + mat[a[i], a[i + 1]]
+        + mat[a[j - 1], a[j]] + mat[a[j], a[j + 1]]
+    )
+    if len(delta) and delta.min() < best[0]:
+        m = int(delta.argmin())
+        new = a.copy()
+        new[i[m]], new[j[m]] = ap_j[m], ap_i[m]
+        best = (int(delta[m]), new)
+
+    # Or-opt: move the segment at positions i to i + length - 1 between
+    # positions p and p + 1, reversed or not
+    for length in range(1, min(SEGMENT_LENGTH, n) + 1):
+        i, p = np.meshgrid(np.arange(1, n - length + 2), np.arange(0, n + 1))
+        i, p = i.ravel(), p.ravel()
+        last = i + length - 1
+        outside = (p < i - 1) | (p > last)
+        i, p, last = i[outside], p[outside], last[outside]
+
+        removed = (
+            mat[a[i - 1], a[last + 1]] - mat[a[i - 1], a[i]] - mat[a[last], a[last + 1]]
+        )
+        if length == 1:
+            # A single node goes through its best AP
+            inserted, ap = via(mat, nodes[i], a[p], a[p + 1])
+            reverse = np.zeros(len(i), dtype=bool)
+        else:
+            forward = mat[a[p], a[i]] + mat[a[last], a[p + 1]]
+            backward = mat[a[p], a[last]] + mat[a[i], a[p + 1]]
+            inserted = np.minimum(forward, backward)
+            reverse = backward < forward
+        delta = removed + inserted - mat[a[p], a[p + 1]]
+        if len(delta) and delta.min() < best[0]:
+            m = int(delta.argmin())
+            mi, ml, mp = i[m], last[m], p[m]
+            segment = a[mi : ml + 1][::-1] if reverse[m] else a[mi : ml + 1].copy()
+            if length == 1:
+                segment[0] = ap[m]
+            rest = np.concatenate([a[:mi], a[ml + 1 :]])
+            at = mp + 1 if mp < mi else mp + 1 - length
+            best = (int(delta[m]), np.concatenate([rest[:at], segment, rest[at:]]))
+
+    return best
+
+
+def local_search(
+    cm: CostMatrix, path: list[int], time_limit: float = LOCAL_SEARCH_TIME
+) -> tuple[int, list[int]]:
+    """
+    Improve a tour with 2-opt, Or-opt and exchange moves, and return it.
+
+    All moves of the tour are evaluated at once from the costs of the edges
+    they change, and the best one is made, until no move is better or
+    time_limit seconds are up. When no move is better, the best AP of every
+    node is chosen again for the order the tour has come to (see
+    choose_aps()), and the search goes on if that made it cheaper.
+
+    Costs between item APs must be the same both ways, which distances on
+    the map are. Tours that don't go from start through all nodes to end,
+    e.g. on a disconnected map, are returned as they are.
+    """
+    cost = cm.tour_cost(path)
+    if cm.start is None or cm.end is None:
+        return cost, path
+
+    # Start at start, end at end
+    tour = np.roll(np.asarray(path, dtype=np.int64), -path.index(cm.start))
+    if (
+        tour[-1] != cm.end
+        or len(tour) != cm.node_count
+        or cost >= INF
+        or cm.node_count < 3
+    ):
+        return cost, path
+
+    mat = padded_matrix(cm)
+    table = node_aps_table(cm)
+    t_end = time() + time_limit
+
+    tour = choose_aps(mat, table, tour)
+    while time() < t_end:
+        delta, new = best_move(mat, table, tour)
+        if delta < 0:
+            tour = new
+            continue
+        new = choose_aps(mat, table, tour)
+        if cm.tour_cost(new) < cm.tour_cost(tour):
+            tour = new
+            continue
+        break
+
+    new_cost = cm.tour_cost(tour)
+    if new_cost >= cost:
+        return cost, path
+    return new_cost, tour.tolist()
@@ -0,0 +1,139 @@
+from __future__ import annotations
+import numpy as np
+from multiprocessing import shared_memory
+from .core import Node, SingleNode, AccessPoint
+
+"""
+Cost matrix shared by all routing algorithms
+"""
+
+# Cost of a move that is not allowed. Larger than any distance on the map,
+# and small enough that a whole tour of such moves still fits in an int32.
+INF = 10**6
+
+# Shared memory blocks of matrices received from other processes, by name
+_attached: dict[str, shared_memory.SharedMemory] = {}
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to the shared memory block of a matrix made by another process,
+    closing the blocks of matrices that are not used anymore first
+    """
+    for old in list(_attached):
+        try:
+            _attached[old].close()
+        except BufferError:
+            continue  # Arrays still point into it
+        del _attached[old]
+
+    shm = shared_memory.SharedMemory(name)
+    _attached[name] = shm
+    return shm
+
+
+class CostMatrix:
+    """
+    Costs between all APs of an order, produced by generate_cost_graph().
+
+    APs are numbered node by node in the order of nodes, and within a node
+    in N-E-S-W order, skipping the APs that do not exist. aps[i] is the AP
+    with index i, and index[ap] goes the other way. node_of[i] is the index
+    of AP i's node, slot[i] its direction (0 - N, 1 - E, 2 - S, 3 - W), and
+    the APs of node k are node_ptr[k] to node_ptr[k + 1] - 1.
+
+    mat[i][j] is the cost of going from AP i to AP j as an int32; moves
+    that are not allowed, e.g. between APs of the same node, cost INF.
+    start and end are the indexes of the start and end APs, if any.
+
+    Only the costs are pickled, not the nodes and APs, so a matrix sent to
+    another process can be solved but not turned into a route there. After
+    share(), mat is kept in shared memory and only the name of the block is
+    pickled, so solver processes read the same costs without a copy.
+    """
+
+    def __init__(self, nodes: list[Node | SingleNode]) -> None:
+        self.nodes = nodes
+        self.aps: list[AccessPoint] = []
+        slot = []
+        node_of = []
+        self.node_ptr = np.zeros(len(nodes) + 1, dtype=np.int32)
+        for k, node in enumerate(nodes):
+            for s, ap in enumerate(node.aps_all):
+                if ap:
+                    self.aps.append(ap)
+                    slot.append(s)
+                    node_of.append(k)
+            self.node_ptr[k + 1] = len(self.aps)
+
+        self.index = {ap: i for i, ap in enumerate(self.aps)}
+        self.slot = np.array(slot, dtype=np.int32)
+        self.node_of = np.array(node_of, dtype=np.int32)
+        self.mat = np.full((len(self.aps), len(self.aps)), INF, dtype=np.int32)
+        self.start: int = None
+        self.end: int = None
+        self._shm: shared_memory.SharedMemory = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        for key in ("nodes", "aps", "index", "_shm"):
+            del state[key]
+        if self._shm is not None:
+            state["mat"] = (self._shm.name, self.mat.shape)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.nodes, self.aps, self.index, self._shm = None, None, None, None
+        if isinstance(self.mat, tuple):
+            name, shape = self.mat
+            self.mat = np.ndarray(shape, dtype=np.int32, buffer=_attach(name).buf)
+
+    def share(self) -> None:
+        """
+        Move mat to a shared memory block, which is freed by close()
+        """
+        if self._shm is not None:
+            return
+        size = max(self.mat.nbytes, 1)  # A block can't be empty
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        mat = np.ndarray(self.mat.shape, dtype=self.mat.dtype, buffer=self._shm.buf)
+        mat[:] = self.mat
+        self.mat = mat
+
+    def close(self) -> None:
+        """
+        Move mat back to private memory and free its shared memory block
+        """
+        if self._shm is None:
+            return
+        self.mat = self.mat.copy()
+        try:
+            self._shm.close()
+        except BufferError:
+            pass  # Arrays still point into it, it is unmapped when they are gone
+        self._shm.unlink()
+        self._shm = None
+
+    @property
+    def node_count(self) -> int:
+        return len(self.node_ptr) - 1
+
+    def __len__(self) -> int:
+        return len(self.node_of)
+
+    def node_aps(self, k: int) -> range:
+        """
+        Return the indexes of node k's APs
+        """
+        return range(self.node_ptr[k], self.node_ptr[k + 1])
+
+    def to_aps(self, path: list[int]) -> list[AccessPoint]:
+        return [self.aps[i] for i in path]
+
+    def tour_cost(self, path: list[int]) -> int:
+        """
+        Return the cost of visiting the APs in path and going back to the first
+        """
+        path = np.asarray(path)
+        return int(self.mat[path, np.roll(path, -1)].astype(np.int64).sum())
@@ -1,85 +1,97 @@
-import heapq
-from .core import Node, AccessPoint, PriorityQueue
+import numpy as np
+from .matrix import CostMatrix, INF
 
-def greedy(
-    nodes: list[Node], start_ap: AccessPoint, end_ap: AccessPoint, init_ap: AccessPoint
-):
+
+def greedy_tours(cm: CostMatrix, inits: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
     """
-    give a list of nodes, return the greedy route
+    Run greedy() from every AP in inits at once, one step of all the routes
+    per iteration, and return the cost of each route and the APs they go
+    through.
+
+    steps[i] is the AP every route goes to in step i, or -1 for the routes
+    that don't go anywhere in that step; the path of route r is the APs in
+    steps[:, r] other than -1. Takes O(N) iterations of O(R * A) array work
+    for R routes, N nodes and A APs.
     """
-    # Init path, path is a list of ap
-    if init_ap == start_ap:
-        init_ap = end_ap
-    path = [init_ap]
-    # Init unvisited set
-    unvisited = set(nodes)
-    unvisited.remove(init_ap.parent)
-    total_cost = 0
+    inits = np.array(inits, dtype=np.int64)
+    if cm.start is not None:
+        inits[inits == cm.start] = cm.end
+    routes = np.arange(len(inits))
 
-    while unvisited:
-        current = path[-1]
-        # end_node should always go to start_node
-        if current == end_ap:
-            path.append(start_ap)
-            unvisited.remove(start_ap.parent)
-            current = start_ap
+    unvisited = np.ones((len(inits), cm.node_count), dtype=bool)
+    unvisited[routes, cm.node_of[inits]] = False
+    current = inits.copy()
+    costs = np.zeros(len(inits), dtype=np.int64)
+    steps = [inits]
+    # Routes still going, i.e. with unvisited nodes and not stuck
+    active = np.ones(len(inits), dtype=bool)
 
-        nearest_neighbor = None
-        nearest_distance = float("inf")
-        # search every access points of unvisited nodes
-        for node in unvisited:
-            ap: AccessPoint
-            for ap in node.aps:
-                if ap not in path:
-                    dist, _trace = current.dv[ap]
-                    if dist < nearest_distance:
-                        nearest_neighbor = ap
-                        nearest_distance = dist
-
-        if nearest_neighbor:
-            path.append(nearest_neighbor)
-            total_cost += nearest_distance
-            # remove visited
-            unvisited.remove(nearest_neighbor.parent)
-        else:
-            # No unvisited neighbors found, the graph might be disconnected
+    while True:
+        active &= unvisited.any(axis=1)
+        if not active.any():
             break
 
+        if cm.end is not None:
+            # end_node should always go to start_node
+            at_end = active & (current == cm.end)
+            if at_end.any():
+                steps.append(np.where(at_end, cm.start, -1))
+                unvisited[at_end, cm.node_of[cm.start]] = False
+                current = np.where(at_end, cm.start, current)
+
+        # search every access points of unvisited nodes
+        dist = np.where(unvisited[:, cm.node_of], cm.mat[current], INF)
+        nearest = dist.argmin(axis=1)
+        nearest_dist = dist[routes, nearest]
+        # No unvisited neighbors found, the graph might be disconnected
+        active &= nearest_dist < INF
+
+        steps.append(np.where(active, nearest, -1))
+        costs += np.where(active, nearest_dist, 0)
+        unvisited[routes[active], cm.node_of[nearest[active]]] = False
+        current = np.where(active, nearest, current)
+
     # Add the back cost to complete the cycle
-    dist, _trace = path[-1].dv[init_ap]
-    total_cost += dist
+    costs += cm.mat[current, inits]
 
-    return total_cost, path
+    return costs, np.array(steps)
 
 
-def nearest_neighbor(nodes: list[Node], start_ap: AccessPoint, end_ap: AccessPoint):
-    all_path = PriorityQueue()
-    for node in nodes:
-        for ap in node.aps:
-            cost, path = greedy(nodes, start_ap, end_ap, ap)
-            all_path.enqueue(path, cost)
+def greedy(cm: CostMatrix, init: int):
+    """
+    give a cost matrix and the AP to begin with, return the greedy route
+    """
+    costs, steps = greedy_tours(cm, [init])
+    path = steps[:, 0]
+    return int(costs[0]), path[path >= 0].tolist()
 
-    bestcost, bestpath = all_path.dequeue()
-    return bestcost, bestpath
+
+def nearest_neighbor(cm: CostMatrix):
+    """
+    Return the cheapest of the greedy routes from every AP, the first one
+    of them if several cost the same
+    """
+    costs, steps = greedy_tours(cm, np.arange(len(cm)))
+    best = int(costs.argmin())
+    path = steps[:, best]
+    return int(costs[best]), path[path >= 0].tolist()
 
 
-def default(nodes: list[Node], start_ap: AccessPoint, end_ap: AccessPoint):
-    path = [start_ap]
+def default(cm: CostMatrix):
+    path = [cm.start]
     total_cost = 0
     curr = path[-1]
 
-    for node in nodes[1:]:
+    for k in range(1, cm.node_count):
         # access node though first not None ap
-        next = node.aps[0]
+        next = int(cm.node_ptr[k])
         path.append(next)
         # record cost
-        cost, trace = curr.dv[next]
-        total_cost += cost
+        total_cost += int(cm.mat[curr, next])
         # update curr
         curr = path[-1]
 
     # Add the back route to complete the cycle
-    dist, _trace = path[-1].dv[start_ap]
-    total_cost += dist
+    total_cost += int(cm.mat[path[-1], cm.start])
 
-    return total_cost, path
\ No newline at end of file
+    return total_cost, path
@@ -0,0 +1,106 @@
+from __future__ import annotations
+import numpy as np
+
+"""
+Product database
+"""
+
+
+def shelf_keys(xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """
+    Combine shelf coordinates into one sortable integer per shelf
+    """
+    return (xs.astype(np.int64) << 32) + ys
+
+
+class ProductDB:
+    """
+    Product ids and the coordinate of the shelf each product is stored on,
+    kept as NumPy arrays sorted by id. Single products are looked up like
+    in a dict (prod_db[id] -> (x, y)), and whole orders at once with a
+    binary search over the sorted ids.
+
+    Products are also indexed by shelf, so that all products on a shelf can
+    be listed without scanning the database.
+    """
+
+    def __init__(self, ids: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> None:
+        # When an id appears more than once, the last row wins like in a dict
+        ids = np.asarray(ids, dtype=np.int64)
+        self.ids, last = np.unique(ids[::-1], return_index=True)
+        last = len(ids) - 1 - last
+        self.xs = np.asarray(xs, dtype=np.int32)[last]
+        self.ys = np.asarray(ys, dtype=np.int32)[last]
+
+        # Shelf index: product indexes sorted by shelf, and the shelf of each
+        shelves = shelf_keys(self.xs, self.ys)
+        self._by_shelf = np.argsort(shelves, kind="stable")
+        self._shelves = shelves[self._by_shelf]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, id: int) -> bool:
+        return bool(self.contains([id])[0])
+
+    def __getitem__(self, id: int) -> tuple[int, int]:
+        idx = self.find([id])[0]
+        if idx < 0:
+            raise KeyError(id)
+        return int(self.xs[idx]), int(self.ys[idx])
+
+    def find(self, id_list: list[int]) -> np.ndarray:
+        """
+        Return the index of every id in the database, -1 for unknown ids
+        """
+        id_list = np.asarray(id_list, dtype=np.int64)
+        idx = np.searchsorted(self.ids, id_list)
+        found = idx < len(self.ids)
+        found[found] = self.ids[idx[found]] == id_list[found]
+        return np.where(found, idx, -1)
+
+    def contains(self, id_list: list[int]) -> np.ndarray:
+        """
+        Return whether each id exists in the database
+        """
+        return self.find(id_list) >= 0
+
+    def locate(self, id_list: list[int]) -> np.ndarray:
+        """
+        Return the shelf coordinates of all ids as an array of (x, y) rows.
+        Raise KeyError on the first unknown id.
+        """
+        idx = self.find(id_list)
+        if (idx < 0).any():
+            raise KeyError(list(id_list)[np.argmax(idx < 0)])
+        return np.stack([self.xs[idx], self.ys[idx]], axis=1)
+
+    def ids_at(self, coord: tuple[int, int]) -> np.ndarray:
+        """
+        Return the ids of all products stored on a shelf
+        """
+        key = shelf_keys(np.array(coord[0]), np.array(coord[1]))
+        lo, hi = np.searchsorted(self._shelves, [key, key + 1])
+        return self.ids[self._by_shelf[lo:hi]]
+
+    def group_by_shelf(
+        self, id_list: list[int]
+    ) -> list[tuple[tuple[int, int], list[int]]]:
+        """
+        Group the ids of an order by their shelf. Shelves are listed in the
+        order they first appear in id_list. Raise KeyError on unknown ids.
+        """
+        coords = self.locate(id_list)
+        if len(coords) == 0:
+            return []
+        keys = shelf_keys(coords[:, 0], coords[:, 1])
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+        groups = [[] for _ in first]
+        for id, group in zip(id_list, inverse.ravel().tolist()):
+            groups[group].append(id)
+
+        return [
+            (tuple(coords[first[group]].tolist()), groups[group])
+            for group in np.argsort(first)
+        ]
@@ -2,37 +2,41 @@
 from __future__ import annotations
 
 import heapq
-from collections import defaultdict
-from itertools import combinations, product
+import numpy as np
 from .core import *
 from .bnb import *
 from .genetic import *
+from .held_karp import *
 from .nearest_neighbor import *
-import multiprocessing
-from time import sleep, time
-from psutil import virtual_memory
+from .local_search import *
+from .matrix import CostMatrix, INF
+from .table import Trace, UNREACHABLE, get_path_table
+import threading
+from time import time
+from .workers import SolverOutOfMemory, SolverTimeout, get_solver_pool
+from .anytime import Cancelled, Progress
 
 
-def prod_to_node(prod_db, map_data, id_list):
-    coord_to_ids = defaultdict(list)
+def prod_to_node(prod_db: ProductDB, map_data: Grid, id_list):
     nodes = []
-    for id in id_list:
-        coord = prod_db[id]
-        coord_to_ids[coord].append(id)
-    for coord, id in coord_to_ids.items():
+    # Items on the same shelf share one node
+    for coord, id in prod_db.group_by_shelf(id_list):
         nodes.append(Node(id, coord, map_data))
     return nodes
 
 
 def generate_cost_graph(
     nodes: list[Node], start_node: SingleNode = None, end_node: SingleNode = None
-) -> None:
+) -> CostMatrix:
     """
     Calculate and store costs between all possible AccessPoint pairs between
     all pairs of nodes from nodes_list.
     e.g. For each of the 16 pairs from the 8 APs: A{n,e,s,w} and B{n,e,s,w},
     calculate 16 distances and store in AccessPoints' distance vectors.
 
+    The same costs are returned as a CostMatrix, which is what the routing
+    algorithms read; the distance vectors keep the paths between APs.
+
     start_node and end_node can be absent
     """
     # Clear all nodes' distance vectors to prevent accidentally accessing APs
@@ -44,19 +48,36 @@ def generate_cost_graph(
         for ap in n.aps:
             ap.dv = dict()
 
+    # Look distances up from the precomputed table if the map has one
+    table = get_path_table(nodes[0]._map)
+
     edges = 0
-    for a, b in combinations(nodes, 2):
+    for idx, a in enumerate(nodes):
         ap_1: AccessPoint  # Type hints for IDE
         ap_2: AccessPoint
-        for ap_1, ap_2 in product(a.aps, b.aps):
-            # Skip if the AP pair has been calculated
-            if ap_2 in ap_1.dv.keys():
-                continue
-
-            dist, route = cost(a._map, ap_1.coord, ap_2.coord)
-            ap_1.add_path(destination=ap_2, distance=dist, path=route)
-            edges += 1
-            # print(f"{ap_1.coord} -> {ap_2.coord}: {dist}")
+        for ap_1 in a.aps:
+            # APs of all following nodes, skipping the pairs that have been calculated
+            dest_aps = [
+                ap_2
+                for b in nodes[idx + 1 :]
+                for ap_2 in b.aps
+                if ap_2 not in ap_1.dv.keys()
+            ]
+            if not table:
+                # One search from ap_1 reaches all of its destinations at once
+                found = costs_from(a._map, ap_1.coord, [ap.coord for ap in dest_aps])
+
+            for ap_2 in dest_aps:
+                if table:
+                    # Only keep a handle, the path is rebuilt when giving instructions
+                    dist = table.distance(ap_1.coord, ap_2.coord)
+                    route = Trace(ap_1.coord, ap_2.coord)
+                else:
+                    dist, path = found.get(ap_2.coord, (float("inf"), [None]))
+                    route = Trace(ap_1.coord, ap_2.coord, route=path)
+                ap_1.add_path(destination=ap_2, distance=dist, path=route)
+                edges += 1
+                # print(f"{ap_1.coord} -> {ap_2.coord}: {dist}")
 
     if start_node and end_node:
         start_ap, end_ap = start_node.aps[0], end_node.aps[0]
@@ -69,40 +90,107 @@ def generate_cost_graph(
                     ap.dv[start_ap] = (float("inf"), path)
                     end_ap.dv[ap] = (float("inf"), path)
         # Set distance[(end, start)] = 0 to ensure end to start is connected
-        end_ap.dv[start_ap] = (0, [None])
+        end_ap.dv[start_ap] = (0, Trace(end_ap.coord, start_ap.coord, route=[None]))
         start_ap.dv[end_ap] = (float("inf"), start_ap.dv[end_ap][1])
 
+    return cost_matrix(nodes, table, start_node, end_node)
+
 
-def cost(map, start, end) -> tuple[int, list[tuple[int, int]]]:
+def cost_matrix(
+    nodes: list[Node],
+    table: PathTable = None,
+    start_node: SingleNode = None,
+    end_node: SingleNode = None,
+) -> CostMatrix:
+    """
+    Build the CostMatrix of nodes, with the same costs as the APs' distance
+    vectors. Distances are taken from the path table in one go if there is
+    one, otherwise from the distance vectors.
+    """
+    cm = CostMatrix(nodes)
+    if table:
+        coords = np.array([ap.coord for ap in cm.aps])
+        cells = table.cell_index[coords[:, 0], coords[:, 1]]
+        dist = table.dist[np.ix_(cells, cells)]
+        cm.mat[:] = np.where(dist == UNREACHABLE, INF, dist)
+    else:
+        for i, ap in enumerate(cm.aps):
+            for dest, (dist, _trace) in ap.dv.items():
+                cm.mat[i, cm.index[dest]] = min(dist, INF)
+
+    # APs of the same node can't be visited one after another
+    cm.mat[cm.node_of[:, None] == cm.node_of[None, :]] = INF
+
+    if start_node and end_node:
+        cm.start, cm.end = cm.index[start_node.aps[0]], cm.index[end_node.aps[0]]
+        # Same as the distance vectors: no one can go to start, end can only
+        # go to start, and start can't go to end directly
+        cm.mat[:, cm.start] = INF
+        cm.mat[cm.end, :] = INF
+        cm.mat[cm.end, cm.start] = 0
+        cm.mat[cm.start, cm.end] = INF
+
+    return cm
+
+
+def cost(map: Grid, start, end) -> tuple[int, list[tuple[int, int]]]:
     """
     calculate distance and shortest route between two single entries
     """
     if not start or not end:
         return (float("inf"), [None])
 
+    table = get_path_table(map)
+    if table:
+        route = table.path(start, end)
+        if route is None:
+            print(f"Path from {start} to {end} not found, check if it is a shelf!")
+            return None
+        return (table.distance(start, end), route)
+
+    return astar(map, start, end)
+
+
+def costs_from(
+    map: Grid, start, ends: list[tuple[int, int]], stats: dict = None
+) -> dict[tuple[int, int], tuple[int, list[tuple[int, int]]]]:
+    """
+    calculate distances and shortest routes from one entry to many entries
+    with a single search, which stops once all of the entries are reached.
+    Ties are broken the same way for every entry as if cost() was called
+    for it alone.
+
+    If stats is given, stats["expanded"] counts the expanded entries.
+    """
     parent = {}
-    route = []
+    results = {}
+    remaining = set(ends)
     # Initialize the distance dictionary with the starting node and a cost of 0
     distance = {start: 0}
     turn_num = {start: 0}
     coming_dir = {start: None}
     # Initialize the priority queue with the starting node and its cost
     open_set = [(0, start)]
-    while open_set:
+    while open_set and remaining:
         # Get the node with the lowest cost from the priority queue
         current_node = heapq.heappop(open_set)[-1]
-
-        if current_node == end:
-            while current_node in parent:
-                route.append(current_node)
-                current_node = parent[current_node]
+        if stats is not None:
+            stats["expanded"] = stats.get("expanded", 0) + 1
+
+        if current_node in remaining:
+            remaining.remove(current_node)
+            route = []
+            node = current_node
+            while node in parent:
+                route.append(node)
+                node = parent[node]
             # append route with start node
             route.append(start)
             costs = len(route) - 1
-            return (costs, route[::-1])
+            results[current_node] = (costs, route[::-1])
 
         # Check each neighbor of the current node
-        for dir, neighbor in get_aps(map, current_node):
+        for dir, neighbor in map.neighbors(current_node):
             # Calculate the tentative cost to reach the neighbor
             tentative_dis = distance[current_node] + 1
             # Calculate the number of turns to reach the neighbor
@@ -118,8 +206,77 @@ def cost(map, start, end) -> tuple[int, list[tuple[int, int]]]:
                 parent[neighbor] = current_node
                 coming_dir[neighbor] = dir
 
-    print(f"Path from {start} to {end} not found, check if it is a shelf!")
-    return None
+    for end in remaining:
+        print(f"Path from {start} to {end} not found, check if it is a shelf!")
+    return results
+
+
+def astar(map: Grid, start, end, stats: dict = None) -> tuple[int, list[tuple[int, int]]]:
+    """
+    calculate distance and shortest route between two single entries with
+    A* and the Manhattan distance as heuristic. Gives the same route as the
+    plain search of costs_from().
+
+    The route of costs_from() only depends on the grids lying on a shortest
+    path from start to end, and all of them have f = g + h <= distance. So
+    the search keeps going until f exceeds the distance, then picks each
+    grid's parent layer by layer the way costs_from() does: the neighbor one
+    step closer to start with the fewest turns, then the smallest coordinate.
+
+    If stats is given, stats["expanded"] counts the expanded entries.
+    """
+    end_x, end_y = end
+
+    distance = {start: 0}
+    closed = {}  # Expanded entries and their final distance
+    best = float("inf")
+    open_set = [(abs(start[0] - end_x) + abs(start[1] - end_y), start)]
+    while open_set:
+        f, current_node = heapq.heappop(open_set)
+        if f > best:
+            break
+        if current_node in closed:
+            continue
+        if stats is not None:
+            stats["expanded"] = stats.get("expanded", 0) + 1
+
+        current_dis = closed[current_node] = distance[current_node]
+        if current_node == end:
+            best = current_dis
+
+        for _dir, neighbor in map.neighbors(current_node):
+            if current_dis + 1 < distance.get(neighbor, float("inf")):
+                distance[neighbor] = current_dis + 1
+                h = abs(neighbor[0] - end_x) + abs(neighbor[1] - end_y)
+                heapq.heappush(open_set, (current_dis + 1 + h, neighbor))
+
+    if best == float("inf"):
+        print(f"Path from {start} to {end} not found, check if it is a shelf!")
+        return None
+
+    # Pick parents in the order costs_from() would have reached the entries
+    parent = {}
+    turn_num = {start: 0}
+    coming_dir = {start: None}
+    for node in sorted(closed, key=closed.get):
+        if node == start:
+            continue
+        prev = None
+        for (d_x, d_y), neighbor in map.neighbors(node):
+            if closed.get(neighbor) != closed[node] - 1:
+                continue
+            # Step from the neighbor to this entry
+            d_x, d_y = -d_x, -d_y
+            turns = turn_num[neighbor] + ((d_x, d_y) != coming_dir[neighbor])
+            key = (turn_num[neighbor], neighbor)
+            if prev is None or key < prev[0]:
+                prev = (key, neighbor, (d_x, d_y), turns)
+        _, parent[node], coming_dir[node], turn_num[node] = prev
+
+    route = [end]
+    while route[-1] != start:
+        route.append(parent[route[-1]])
+    return (best, route[::-1])
 
 
 def path_instructions(
@@ -137,7 +294,7 @@ def path_instructions(
 
     ap = path[0]
     for next in path[1:]:
-        trace = ap.dv[next][1]
+        trace = ap.path_to(next)
         route += trace[1:]
         instruction_str += get_step_instructions(trace)
         if next.parent.id == [-1]:
@@ -194,11 +351,72 @@ def get_step_instructions(trace: list[tuple]):
     return instruction_str
 
 
-def load_animation():
+def load_animation(stop: threading.Event):
+    """
+    Show a spinner until stop is set
+    """
     while True:
         for c in "|/-\\":
             print(c, end="\r")
-            sleep(0.1)
+            if stop.wait(0.1):
+                return
+
+
+def _solve(
+    cm: CostMatrix,
+    algorithm="g",
+    beam_width: int = BEAM_WIDTH,
+    bound: str = "reduce",
+    islands: int = 1,
+    migration_interval: int = MIGRATION_INTERVAL,
+    progress: Progress = None,
+) -> tuple[int, list[int]]:
+    """
+    Return the cost and path of the tour the algorithm finds in cm.
+
+    Tours found by the algorithm are reported to progress. If progress gets
+    cancelled, the best tour found so far is returned.
+    """
+    if progress is None:
+        progress = Progress()
+    incumbent = None
+    if algorithm in ["b", "d", "p", "h", "s", "t"]:
+        # Have a tour to show right away, in case the algorithm is cancelled
+        incumbent = nearest_neighbor(cm)
+        progress.improve(*incumbent)
+
+    try:
+        if algorithm == "b":  # branch and bound
+            return branch_and_bound(cm, incumbent, bound, progress=progress)
+        elif algorithm == "d":  # depth-first branch and bound
+            return branch_and_bound_dfs(cm, incumbent, bound, progress=progress)
+        elif algorithm == "p":  # parallel branch and bound
+            return parallel_branch_and_bound(
+                cm, incumbent=incumbent, bound=bound, progress=progress
+            )
+        elif algorithm == "h":  # Held-Karp dynamic programming
+            if cm.node_count - 2 > MAX_ITEMS:
+                # Too much memory, depth-first branch and bound is exact too
+                return branch_and_bound_dfs(cm, incumbent, bound, progress=progress)
+            return held_karp(cm, progress=progress)
+        elif algorithm == "s":  # beam search
+            return beam_search(cm, beam_width, incumbent, bound, progress=progress)
+        elif algorithm == "g":  # greedy
+            return greedy(cm, init=cm.start)
+        elif algorithm == "n":  # nearest neighbor
+            return nearest_neighbor(cm)
+        elif algorithm == "t":
+            return parallel_genetic(
+                cm,
+                islands,
+                migration_interval,
+                progress=progress,
+                incumbent=incumbent,
+            )
+        elif algorithm == "f":  # fallback
+            return default(cm)
+    except Cancelled:
+        return progress.cost, progress.path
 
 
 def _find_route(
@@ -206,104 +424,163 @@ def _find_route(
     start_node: SingleNode,
     end_node: SingleNode,
     algorithm="g",
-    shared_list: list = [],
+    beam_width: int = BEAM_WIDTH,
+    bound: str = "reduce",
+    islands: int = 1,
+    migration_interval: int = MIGRATION_INTERVAL,
+    improve: bool = True,
 ):
     """
     NOTE: Do not use this function directly, as it has the potential to use up all
     RAM when running BnB with an input that is large enough.
-    Use find_route_with_timeout for RAM protection and timeout if wished.
+    Use find_route for RAM protection and timeout if wished.
+
+    If improve, the tour found is improved with local_search() before it is
+    turned into a route.
     """
 
     # Calculate the graph(distance and route between all the accessible entries)
     start_ap, end_ap = start_node.aps_all[0], end_node.aps_all[0]
     nodes = [start_node] + item_nodes + [end_node]
-    generate_cost_graph(nodes, start_node=start_node, end_node=end_node)
-
-    if algorithm == "b":  # branch and bound
-        _cost, path = branch_and_bound(nodes, start_ap, end_ap)
-    elif algorithm == "g":  # greedy
-        _cost, path = greedy(nodes, start_ap, end_ap, init_ap=start_ap)
-    elif algorithm == "n":  # nearest neighbor
-        _cost, path = nearest_neighbor(nodes, start_ap, end_ap)
-    elif algorithm == "t":
-        _cost, path = genetic(item_nodes, start_node, end_node)
-    elif algorithm == "f":  # fallback
-        _cost, path = default(nodes, start_ap, end_ap)
+    cm = generate_cost_graph(nodes, start_node=start_node, end_node=end_node)
 
-    instructions, route, total_cost = path_instructions(path, start_ap, end_ap)
+    _cost, path = _solve(
+        cm, algorithm, beam_width, bound, islands, migration_interval
+    )
+    if improve:
+        _cost, path = local_search(cm, path)
 
-    # Save return values as tuple into shared list for use in timeout monitor function
-    shared_list.append((instructions, total_cost, route))
+    instructions, route, total_cost = path_instructions(
+        cm.to_aps(path), start_ap, end_ap
+    )
 
     return instructions, total_cost, route
 
 
+def solver_pool():
+    """
+    Return the pool of processes find_route() solves orders in. Call it once
+    the inventory has been read, so that the processes start with the map
+    and path table loaded.
+
+    Only the cost matrix of an order is sent to a process, through shared
+    memory, and only the tour comes back; the cost graph and the route are
+    made in this process.
+    """
+    return get_solver_pool(_solve, initializer=warm_up)
+
+
 def find_route(
     item_nodes: list[Node],
     start_node: SingleNode,
     end_node: SingleNode,
     algorithm: str,
     timeout: int,
+    beam_width: int = BEAM_WIDTH,
+    bound: str = "reduce",
+    memory_budget: int = None,
+    islands: int = 1,
+    migration_interval: int = MIGRATION_INTERVAL,
+    improve: bool = True,
 ):
     """
-    Find route with the specified algorithm. The algorithm process will be killed
-    after timeout.
+    Find route with the specified algorithm, in a process of the solver pool. After
+    timeout, the algorithm is stopped and the best route it found is returned.
+    beam_width is the number of tree nodes beam search keeps per depth, and bound
+    the lower bound branch and bound and beam search use (see BOUNDS). islands is
+    the number of populations the genetic algorithm evolves in parallel, which
+    exchange their best tours every migration_interval rounds. If improve, the tour
+    found is improved with local_search() before it is turned into a route, which
+    gets LOCAL_SEARCH_SHARE of the timeout, and at most LOCAL_SEARCH_TIME.
+
+    memory_budget is the RAM in MiB the solver process may use, the one of Config
+    by default. Close to it, branch and bound goes on depth first; over it, the
+    solver process is killed and the best route it reported is returned.
+
+    Returns the instructions, the total cost and the route, and why the algorithm
+    didn't give the route ("stopped at timeout", "stopped over the memory budget",
+    or "failed, used Nearest neighbor instead"), or "" if it did.
 
     NOTE: Timeout = -1 disables timeout, and the algorithm will run indefinitely or
     until it uses too much RAM.
     """
 
-    manager = multiprocessing.Manager()
-    shared_list = manager.list()
-    timeout_triggered = False  # Timeout indicator
+    stopped = ""  # Why the algorithm didn't give the route, if it didn't
 
-    animation_process = multiprocessing.Process(
-        target=load_animation,
-    )
-    algorithm_process = multiprocessing.Process(
-        target=_find_route,
-        args=(item_nodes, start_node, end_node, algorithm, shared_list),
-    )
+    # Replace killed solver processes before there is another thread to fork
+    pool = solver_pool()
+    pool.fill()
 
-    animation_process.start()
-    algorithm_process.start()
+    stop_animation = threading.Event()
+    animation_thread = threading.Thread(target=load_animation, args=(stop_animation,))
+    animation_thread.start()
 
+    if memory_budget is None:
+        memory_budget = Config().memory_budget
     if timeout == -1:  # No timeout
-        timeout = float("inf")
-    t_start = time()
-    while True:
-        sleep(0.1)
-        if algorithm_process.is_alive():
-            if time() - t_start > timeout:
-                print(f"Algorithm timed out! Using fallback algorithm...")
-                timeout_triggered = True
-                break
-
-            elif virtual_memory().percent > 80:
-                print(f"Algorithm is using too much RAM! Using fallback algorithm...")
-                timeout_triggered = True
-                break
-
-        else:
-            # Algorithm finished successfully
-            instructions, total_cost, route = shared_list[0]
-            break
-
-    if timeout_triggered:
-        # If the algorithm is still alive after timeout, terminate the algorithm
-        # and fallback to the default order
-        algorithm_process.terminate()
-        algorithm_process.join()
-
-        instructions, total_cost, route = _find_route(
-            item_nodes,
-            start_node,
-            end_node,
-            "n",  # Use Nearest Neighbor algorithm as fallback (no timeout)
+        timeout = None
+    t_end = None if timeout is None else time() + timeout
+    solve_timeout = timeout
+    if timeout is not None and improve and algorithm not in ["g", "n", "f"]:
+        # Leave time to improve the tour within the timeout. Greedy algorithms
+        # can't be cancelled, local search gets the time they leave.
+        solve_timeout = timeout - min(LOCAL_SEARCH_TIME, LOCAL_SEARCH_SHARE * timeout)
+    cm = None
+    try:
+        # Calculate the graph(distance and route between all the accessible entries)
+        start_ap, end_ap = start_node.aps_all[0], end_node.aps_all[0]
+        nodes = [start_node] + item_nodes + [end_node]
+        cm = generate_cost_graph(nodes, start_node=start_node, end_node=end_node)
+        cm.share()
+
+        tour = None
+        try:
+            tour, cancelled = pool.solve(
+                cm,
+                algorithm,
+                beam_width=beam_width,
+                bound=bound,
+                islands=islands,
+                migration_interval=migration_interval,
+                timeout=solve_timeout,
+                memory_budget=memory_budget * 2**20,
+            )
+            if cancelled:
+                # Cancelled, and returned the best tour it found in time
+                print(f"Algorithm timed out! Using the best route found so far...")
+                stopped = "stopped at timeout"
+        except SolverTimeout as e:
+            print(f"Algorithm timed out! Using the best route found so far...")
+            stopped = "stopped at timeout"
+            tour = e.tour
+        except SolverOutOfMemory as e:
+            print(f"Algorithm is using too much RAM! Using the best route found so far...")
+            stopped = "stopped over the memory budget"
+            tour = e.tour  # Last tour the killed solver process reported
+        except Exception as e:
+            print(f"Algorithm failed ({e})! Using Nearest Neighbor instead...")
+            stopped = "failed, used Nearest neighbor instead"
+
+        if tour is None:
+            # No tour was reported, fallback to Nearest Neighbor algorithm on the
+            # same graph
+            tour = nearest_neighbor(cm)
+        _cost, path = tour
+        if improve:
+            time_limit = LOCAL_SEARCH_TIME
+            if t_end is not None:
+                time_limit = min(time_limit, t_end - time())
+            if time_limit > 0:  # Skipped once the timeout is up
+                _cost, path = local_search(cm, path, time_limit)
+
+        instructions, route, total_cost = path_instructions(
+            cm.to_aps(path), start_ap, end_ap
         )
-
-    # Stop the loading animation
-    animation_process.terminate()
-    animation_process.join()
-
-    return instructions, total_cost, route, timeout_triggered
+    finally:
+        if cm is not None:
+            cm.close()
+        # Stop the loading animation
+        stop_animation.set()
+        animation_thread.join()
+
+    return instructions, total_cost, route, stopped
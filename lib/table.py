@@ -0,0 +1,264 @@
+from __future__ import annotations
+import os
+import numpy as np
+from .grid import DIRECTIONS, Grid
+
+"""
+All-pairs shortest path table of the warehouse map
+"""
+
+# Marks an unreachable cell in the distance table
+UNREACHABLE = -1
+
+# Header of a cache file: magic, map fingerprint, then cols/rows/size as int32
+CACHE_MAGIC = b"WHPATHS1"
+CACHE_HEADER_SIZE = 64
+
+
+class PathTable:
+    """
+    Distances and shortest paths between every pair of free grids on a map.
+
+    dist[i][j] is the distance from free grid i to free grid j, and pred[i][j]
+    is the direction (index of DIRECTIONS) of the last step taken to reach j
+    when starting from i. Paths are rebuilt from pred on demand and are the
+    same grid-by-grid paths cost() would return, including its tie-breaking
+    on the number of turns.
+    """
+
+    def __init__(
+        self, cell_index: np.ndarray, dist: np.ndarray, pred: np.ndarray
+    ) -> None:
+        self.cell_index = cell_index  # map[X][Y] -> free grid index, -1 for shelves
+        self.dist = dist
+        self.pred = pred
+
+    def index(self, coord: tuple[int, int]) -> int:
+        x, y = coord
+        cols, rows = self.cell_index.shape
+        if 0 <= x < cols and 0 <= y < rows:
+            return int(self.cell_index[x, y])
+        return -1
+
+    def distance(self, start: tuple[int, int], end: tuple[int, int]) -> int:
+        """
+        Return the distance between two grids, or infinity if there is no path
+        """
+        i, j = self.index(start), self.index(end)
+        if i < 0 or j < 0 or self.dist[i, j] == UNREACHABLE:
+            return float("inf")
+        return int(self.dist[i, j])
+
+    def path(
+        self, start: tuple[int, int], end: tuple[int, int]
+    ) -> list[tuple[int, int]] | None:
+        """
+        Rebuild the grid-by-grid path from start to end, or None if there is no path
+        """
+        i, j = self.index(start), self.index(end)
+        if i < 0 or j < 0 or self.dist[i, j] == UNREACHABLE:
+            return None
+
+        route = [end]
+        x, y = end
+        for _ in range(int(self.dist[i, j])):
+            d_x, d_y = DIRECTIONS[self.pred[i, self.cell_index[x, y]]]
+            x, y = x - d_x, y - d_y
+            route.append((x, y))
+
+        return route[::-1]
+
+
+class Trace:
+    """
+    Handle to the grid-by-grid path between two grids, stored in place of
+    the path itself. Only the two ends are kept, and the path is rebuilt
+    from the map's path table when it is asked for.
+
+    If the path was found without a path table, it is kept in route and
+    shared by the handles of both directions.
+    """
+
+    __slots__ = ("start", "end", "reverse", "route")
+
+    def __init__(
+        self,
+        start: tuple[int, int],
+        end: tuple[int, int],
+        reverse: bool = False,
+        route: list[tuple[int, int]] = None,
+    ) -> None:
+        self.start, self.end = start, end
+        self.reverse = reverse  # Walk the path from end to start
+        self.route = route
+
+    def reversed(self) -> Trace:
+        return Trace(self.start, self.end, not self.reverse, self.route)
+
+    def path(self, map: Grid) -> list[tuple[int, int]]:
+        route = self.route
+        if route is None:
+            route = get_path_table(map).path(self.start, self.end)
+        return route[::-1] if self.reverse else route
+
+
+def build_path_table(map: Grid) -> PathTable:
+    """
+    Run the same search as cost() from every free grid at once, one BFS layer
+    at a time.
+
+    cost() pops grids by (distance, turns, coordinate) and never updates a grid
+    once it is reached, so a grid's predecessor is its neighbor one layer
+    closer with the smallest (turns, coordinate). Each layer picks that
+    neighbor for all searches at once with array operations.
+    """
+    size = len(map.coords)
+
+    # Free neighbor of each free grid in each direction, -1 if there is none
+    neighbors = np.full((size, len(DIRECTIONS)), -1, dtype=np.int32)
+    neighbors[
+        np.repeat(np.arange(size), np.diff(map.indptr)), map.neighbor_dir
+    ] = map.neighbor_idx
+
+    dist = np.full((size, size), UNREACHABLE, dtype=np.int16)
+    turns = np.zeros((size, size), dtype=np.int32)
+    pred = np.full((size, size), -1, dtype=np.int8)
+
+    # Frontier of every search as (source, grid) pairs
+    src = np.arange(size)
+    cur = np.arange(size)
+    dist[src, cur] = 0
+
+    layer = 0
+    while len(src):
+        # Expand every frontier grid in every direction
+        from_src = np.repeat(src, len(DIRECTIONS))
+        from_cur = np.repeat(cur, len(DIRECTIONS))
+        step = np.tile(np.arange(len(DIRECTIONS), dtype=np.int8), len(src))
+        to = neighbors[cur].ravel()
+
+        valid = to >= 0
+        valid[valid] = dist[from_src[valid], to[valid]] == UNREACHABLE
+        from_src, from_cur, step, to = (
+            from_src[valid],
+            from_cur[valid],
+            step[valid],
+            to[valid],
+        )
+
+        # Free grid indexes follow coordinate order, so this key sorts the
+        # same way as (turns, coordinate) in cost()'s priority queue
+        key = turns[from_src, from_cur].astype(np.int64) * size + from_cur
+        pair = from_src.astype(np.int64) * size + to
+        order = np.lexsort((key, pair))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = pair[order][1:] != pair[order][:-1]
+        order = order[first]
+        from_src, from_cur, step, to = (
+            from_src[order],
+            from_cur[order],
+            step[order],
+            to[order],
+        )
+
+        layer += 1
+        dist[from_src, to] = layer
+        turns[from_src, to] = turns[from_src, from_cur] + (
+            pred[from_src, from_cur] != step
+        )
+        pred[from_src, to] = step
+        src, cur = from_src, to
+
+    return PathTable(cell_index=map.cell_index.copy(), dist=dist, pred=pred)
+
+
+def save_path_table(table: PathTable, fingerprint: str, cache_path: str) -> None:
+    """
+    Write a path table to a binary cache file so that later launches can
+    memory-map it instead of building it again
+    """
+    cols, rows = table.cell_index.shape
+    header = CACHE_MAGIC + fingerprint.encode("ascii")
+    header += np.array([cols, rows, len(table.dist)], dtype=np.int32).tobytes()
+    header = header.ljust(CACHE_HEADER_SIZE, b"\0")
+
+    # Write to a temporary file first so that no one reads a partial cache
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(table.cell_index.astype(np.int32).tobytes())
+        f.write(table.dist.astype(np.int16).tobytes())
+        f.write(table.pred.astype(np.int8).tobytes())
+    os.replace(tmp_path, cache_path)
+
+
+def open_path_table(fingerprint: str, cache_path: str) -> PathTable | None:
+    """
+    Memory-map a path table from a cache file. Return None if the file does
+    not exist, is damaged, or was built from another map.
+    """
+    try:
+        with open(cache_path, "rb") as f:
+            header = f.read(CACHE_HEADER_SIZE)
+        if header[: len(CACHE_MAGIC)] != CACHE_MAGIC:
+            return None
+        offset = len(CACHE_MAGIC)
+        if header[offset : offset + len(fingerprint)] != fingerprint.encode("ascii"):
+            return None  # The map has changed since the cache was written
+        offset += len(fingerprint)
+        cols, rows, size = np.frombuffer(header, dtype=np.int32, count=3, offset=offset)
+        cols, rows, size = int(cols), int(rows), int(size)
+
+        offset = CACHE_HEADER_SIZE
+        cell_index = np.memmap(
+            cache_path, dtype=np.int32, mode="r", offset=offset, shape=(cols, rows)
+        )
+        offset += cell_index.nbytes
+        dist = np.memmap(
+            cache_path, dtype=np.int16, mode="r", offset=offset, shape=(size, size)
+        )
+        offset += dist.nbytes
+        pred = np.memmap(
+            cache_path, dtype=np.int8, mode="r", offset=offset, shape=(size, size)
+        )
+    except (OSError, ValueError):
+        return None
+
+    # Plain array views of the mapped file are faster to index than memmaps
+    return PathTable(
+        cell_index=np.asarray(cell_index), dist=np.asarray(dist), pred=np.asarray(pred)
+    )
+
+
+_path_tables: dict[str, PathTable] = dict()
+
+
+def load_path_table(map: Grid, cache_path: str = None) -> PathTable:
+    """
+    Build the path table of a map, or reuse it if it was built before.
+
+    If cache_path is given, the table is memory-mapped from that file when
+    it was written for the same map, and (re)written to it otherwise.
+    """
+    key = map.fingerprint
+    if key in _path_tables:
+        return _path_tables[key]
+
+    table = open_path_table(key, cache_path) if cache_path else None
+    if table is None:
+        table = build_path_table(map)
+        if cache_path:
+            try:
+                save_path_table(table, key, cache_path)
+            except OSError:
+                pass  # Not being able to cache is not an error, e.g. read-only data
+
+    _path_tables[key] = table
+    return table
+
+
+def get_path_table(map: Grid) -> PathTable | None:
+    """
+    Return the path table of a map if it has been loaded, otherwise None
+    """
+    return _path_tables.get(map.fingerprint)
@@ -1,9 +1,14 @@
 from numpy import transpose
+from .grid import Grid
 
 ALGS = {
     "b": "Branch and bound",
+    "d": "Depth-first branch and bound",
+    "p": "Parallel branch and bound",
+    "h": "Held-Karp",
     "g": "Greedy",
     "n": "Nearest neighbor",
+    "s": "Beam search",
     "t": "Genetic",
 }
 class Menu:
@@ -198,16 +203,16 @@ def debug(text=""):
 
 
 # Draw the text map
-def draw_text_map(map_data: list[list[int]]):
+def draw_text_map(map_data: Grid):
     # Initialize ASCII map buffer
-    cols, rows = len(map_data), len(map_data[0])
+    cols, rows = map_data.cols, map_data.rows
     map_text = [["__"] * (rows) for _ in range(cols)]  # 40*21 2-d list
 
     for x in range(cols):
         for y in range(rows):
             # Mark all 1's in map_data as non-destination shelves
             # (obstacles) in ASCII map
-            if map_data[x][y] == 1:
+            if map_data.is_shelf((x, y)):
                 map_text[x][y] = "**"
 
     return map_text
@@ -272,8 +277,8 @@ def print_map(full_map: str):
     print(legends)
     print()
 
-def show_result(map_data, conf, item_locations, instr, total_cost, route, timeout):
-    cols, rows = len(map_data), len(map_data[0])
+def show_result(map_data, conf, item_locations, instr, total_cost, route, stopped):
+    cols, rows = map_data.cols, map_data.rows
     # Draw text map
     map_text = draw_text_map(map_data)
     # Add route paths to map
@@ -286,5 +291,5 @@ def show_result(map_data, conf, item_locations, instr, total_cost, route, timeou
     print_map(map_full)
     print(instr)
     print(
-        f"Total distance is {total_cost}. (Calculated with {'Nearest Neighbor' if timeout else ALGS[conf.default_algorithm]})"
+        f"Total distance is {total_cost}. (Calculated with {ALGS[conf.default_algorithm]}{', ' + stopped if stopped else ''})"
     )
@@ -0,0 +1,260 @@
+from __future__ import annotations
+import atexit
+import multiprocessing
+import os
+from multiprocessing import resource_tracker
+from multiprocessing.connection import wait
+from queue import Queue
+from time import time
+import psutil
+from .anytime import Progress
+
+"""
+Pool of long-lived solver processes
+"""
+
+# Seconds between checks of the RAM usage while waiting for a solver
+RAM_CHECK_INTERVAL = 0.1
+
+# Share of its memory budget a solver can use before it is told to save memory
+LOW_MEMORY = 0.8
+
+# Seconds a cancelled solver has to return the best tour it found
+CANCEL_GRACE = 1
+
+
+class SolverTimeout(Exception):
+    """
+    A solver process didn't stop in time and was replaced. tour is the last
+    (cost, path) it reported, or None.
+    """
+
+    def __init__(self, tour: tuple[int, list[int]] = None) -> None:
+        super().__init__("Solver process didn't stop in time")
+        self.tour = tour
+
+
+class SolverOutOfMemory(Exception):
+    """
+    A solver process went over its memory budget and was replaced. tour is
+    the last (cost, path) it reported, or None.
+    """
+
+    def __init__(self, tour: tuple[int, list[int]] = None) -> None:
+        super().__init__("Solver process went over its memory budget")
+        self.tour = tour
+
+
+def _serve(conn, f_solve, initializer, cancel, low_memory):
+    """
+    Main loop of a solver process: call f_solve with the arguments received
+    from conn and send back the result (or the exception raised), until
+    the other end of conn is closed.
+
+    f_solve gets a Progress as the progress keyword argument. Every tour
+    it reports is sent back right away, and it is cancelled and told to
+    save memory through the cancel and low_memory events.
+    """
+    if initializer is not None:
+        initializer()
+
+    def send_improvement(cost, path):
+        conn.send(("improve", (cost, path)))
+
+    while True:
+        try:
+            args, kwargs = conn.recv()
+        except EOFError:
+            break  # The pool, or the whole program, is gone
+
+        progress = Progress(send_improvement, cancel, low_memory)
+        try:
+            result = (True, f_solve(*args, progress=progress, **kwargs))
+        except Exception as e:
+            result = (False, e)
+        conn.send(("done", result))
+
+
+class Worker:
+    """
+    A solver process, the pipe to send it work through, and the events to
+    cancel its work and to tell it to save memory with
+    """
+
+    def __init__(self, f_solve, initializer=None) -> None:
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.cancel = multiprocessing.Event()
+        self.low_memory = multiprocessing.Event()
+        # Not a daemon, so that solvers can start processes of their own
+        self.process = multiprocessing.Process(
+            target=_serve,
+            args=(child_conn, f_solve, initializer, self.cancel, self.low_memory),
+        )
+        self.process.start()
+        self.ps = psutil.Process(self.process.pid)
+        child_conn.close()
+
+    def memory_used(self) -> int:
+        """
+        Return the RSS of the process, plus the USS of the processes it
+        started, in bytes. They are forked and share most of their pages
+        with it, which their RSS would count once per process.
+        """
+        used = self.ps.memory_info().rss
+        for child in self.ps.children(recursive=True):
+            try:
+                used += child.memory_full_info().uss
+            except psutil.NoSuchProcess:
+                pass  # Done already
+        return used
+
+    def stop(self):
+        # Processes the solver started would be left waiting for it forever
+        try:
+            children = self.ps.children(recursive=True)
+        except psutil.NoSuchProcess:
+            children = []
+        self.process.terminate()
+        for child in children:
+            try:
+                child.terminate()
+            except psutil.NoSuchProcess:
+                pass
+        self.process.join()
+        psutil.wait_procs(children)
+        self.conn.close()
+
+
+class SolverPool:
+    """
+    Processes that stay alive between orders, so that an order doesn't pay
+    for starting a process, importing the libraries, or loading the map.
+    Processes are started by forking when the platform allows it, and get
+    the state of the parent (map, path table, compiled kernels) for free;
+    initializer is called once in each new process to get anything else
+    ready.
+
+    solve() hands the arguments to an idle process and blocks until its
+    result comes back through the pipe. A process that runs out of time is
+    asked to stop, and is killed if it doesn't. The same goes for memory:
+    each solve has a budget of its own, and a process close to it is asked
+    to save memory, and is killed if it goes over.
+
+    Killed processes are replaced by fill(), not in the middle of a solve:
+    forking while other threads run (e.g. a spinner) can leave the child
+    stuck on a lock one of them held. Call it while no other threads are
+    running; solve() calls it too if no process is idle.
+    """
+
+    def __init__(self, f_solve, size: int = 1, initializer=None) -> None:
+        self.f_solve = f_solve
+        self.initializer = initializer
+        self.size = size
+        self.workers: list[Worker] = []
+        self._idle: Queue[Worker] = Queue()
+        # Start the resource tracker before the processes, so that they share
+        # it: shared memory they attach to stays registered to its creator.
+        # There is no resource tracker on Windows.
+        if os.name == "posix":
+            resource_tracker.ensure_running()
+        self.fill()
+
+    def fill(self):
+        """
+        Start processes until there are size of them
+        """
+        while len(self.workers) < self.size:
+            worker = Worker(self.f_solve, self.initializer)
+            self.workers.append(worker)
+            self._idle.put(worker)
+
+    def _retire(self, worker: Worker):
+        worker.stop()
+        self.workers.remove(worker)
+
+    def solve(
+        self, *args, timeout: float = None, memory_budget: int = None, **kwargs
+    ):
+        """
+        Return f_solve(*args, **kwargs), computed by one of the processes, and
+        whether it was cancelled on timeout.
+
+        When timeout seconds are up, f_solve is cancelled and has
+        CANCEL_GRACE seconds to return what it has. Once the process uses
+        LOW_MEMORY of memory_budget bytes (see Worker.memory_used()), f_solve
+        is told to save memory. If it doesn't stop in time, or goes over
+        the budget, the process is killed and SolverTimeout or
+        SolverOutOfMemory is raised, with the last (cost, path) reported by
+        f_solve (or None) as tour. Exceptions raised by f_solve are raised
+        again here.
+        """
+        if self._idle.empty():
+            self.fill()
+        worker = self._idle.get()
+        try:
+            worker.cancel.clear()
+            worker.low_memory.clear()
+            worker.conn.send((args, kwargs))
+
+            improvement = None  # Last tour reported
+            cancelled = False
+            t_end = float("inf") if timeout is None else time() + timeout
+            while True:
+                # Wake up as soon as something is sent (or the process dies)
+                ready = wait(
+                    [worker.conn, worker.process.sentinel],
+                    min(RAM_CHECK_INTERVAL, max(t_end - time(), 0)),
+                )
+                if ready:
+                    try:
+                        kind, message = worker.conn.recv()
+                    except EOFError:
+                        kind = None  # The process died
+                    if kind == "done":
+                        ok, result = message
+                        if not ok:
+                            raise result
+                        return result, cancelled
+                    elif kind == "improve":
+                        improvement = message
+                    else:
+                        self._retire(worker)
+                        raise ChildProcessError("Solver process died")
+                if time() >= t_end:
+                    if cancelled:
+                        # Didn't stop in time, take the last tour reported
+                        self._retire(worker)
+                        raise SolverTimeout(improvement)
+                    worker.cancel.set()
+                    cancelled = True
+                    t_end = time() + CANCEL_GRACE
+                if memory_budget is not None:
+                    used = worker.memory_used()
+                    if used > memory_budget:
+                        self._retire(worker)
+                        raise SolverOutOfMemory(improvement)
+                    if used > LOW_MEMORY * memory_budget:
+                        worker.low_memory.set()
+        finally:
+            if worker in self.workers:
+                self._idle.put(worker)
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+
+
+_solver_pool: SolverPool = None
+
+
+def get_solver_pool(f_solve, initializer=None) -> SolverPool:
+    """
+    Return the pool of solver processes of this program, starting it on
+    the first call. It is closed when the program exits.
+    """
+    global _solver_pool
+    if _solver_pool is None:
+        _solver_pool = SolverPool(f_solve, initializer=initializer)
+        atexit.register(_solver_pool.close)
+    return _solver_pool
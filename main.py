@@ -1,5 +1,6 @@
 import argparse
 import datetime
+import multiprocessing
 import os
 import signal
 from random import choice
@@ -17,6 +18,8 @@ CONF = Config(
     start_position=(0, 0),
     end_position=(0, 0),
     default_timeout_value=15,
+    bound="reduce",
+    islands=1,
     map_data=None,
     prod_db=None,
 )
@@ -51,13 +54,13 @@ def input_config_save_instructions(conf: Config):
 
 def input_default_algorithm(conf: Config):
     str_default_algorithm = input_data_as_list(
-        "Choose a default algorithm of your choice (b/n/g/t)\nb - branch and bound; n - nearest neighbor; g - greedy; t - genetic",
+        "Choose a default algorithm of your choice (b/d/p/h/s/n/g/t)\nb - branch and bound; d - depth-first branch and bound; p - parallel branch and bound; h - Held-Karp (exact, depth-first branch and bound above 18 shelves); s - beam search; n - nearest neighbor; g - greedy; t - genetic",
         "s",
         1,
     )[0]
     while str_default_algorithm not in ALGS.keys():
         str_default_algorithm = input_data_as_list(
-            "Please choose a valid algorithm. (b/n/g/t)",
+            "Please choose a valid algorithm. (b/d/p/h/s/n/g/t)",
             "s",
             1,
         )[0]
@@ -80,6 +83,82 @@ def input_timeout_value(conf: Config):
     print(f"Set timeout value to {timeout_value}s.")
 
 
+def input_beam_width(conf: Config):
+    beam_width = input_data_as_list(
+        "How many routes should beam search keep at each step? (1 - 1000) ", "d", 1
+    )[0]
+    while True:
+        if beam_width < 1 or beam_width > 1000:
+            beam_width = input_data_as_list(
+                "Invalid width, please try again! ", "d", 1
+            )[0]
+        else:
+            break
+    conf.beam_width = beam_width
+    print(f"Set beam width to {beam_width}.")
+
+
+def input_memory_budget(conf: Config):
+    memory_budget = input_data_as_list(
+        "How much RAM (MiB) may the algorithm use? (256 - 65536) ", "d", 1
+    )[0]
+    while True:
+        if memory_budget < 256 or memory_budget > 65536:
+            memory_budget = input_data_as_list(
+                "Invalid memory budget, please try again! ", "d", 1
+            )[0]
+        else:
+            break
+    conf.memory_budget = memory_budget
+    print(f"Set memory budget to {memory_budget} MiB.")
+
+
+def input_islands(conf: Config):
+    islands = input_data_as_list(
+        f"How many populations should the genetic algorithm evolve in parallel? (1 - 64, {os.cpu_count()} CPUs) ",
+        "d",
+        1,
+    )[0]
+    while True:
+        if islands < 1 or islands > 64:
+            islands = input_data_as_list(
+                "Invalid number of populations, please try again! ", "d", 1
+            )[0]
+        else:
+            break
+    conf.islands = islands
+    print(f"Set number of populations to {islands}.")
+
+
+def input_migration_interval(conf: Config):
+    migration_interval = input_data_as_list(
+        "Every how many rounds should the populations exchange their best routes? (1 - 1000) ",
+        "d",
+        1,
+    )[0]
+    while True:
+        if migration_interval < 1 or migration_interval > 1000:
+            migration_interval = input_data_as_list(
+                "Invalid number of rounds, please try again! ", "d", 1
+            )[0]
+        else:
+            break
+    conf.migration_interval = migration_interval
+    print(f"Set migration interval to {migration_interval} rounds.")
+
+
+def input_bound(conf: Config):
+    bound = input_data_as_list(
+        "Choose the lower bound for branch and bound and beam search (r/a)\nr - matrix reduction; a - assignment (fewer branches, slower to compute)",
+        "s",
+        1,
+    )[0]
+    while bound not in ["r", "a"]:
+        bound = input_data_as_list("Please choose a valid bound. (r/a)", "s", 1)[0]
+    conf.bound = {"r": "reduce", "a": "assignment"}[bound]
+    print(f"Set lower bound to {conf.bound}")
+
+
 def input_start_end_pos(conf: Config):
     start_position = input_data_as_list("Please enter the start position ", "c", 1)[0]
     while True:
@@ -112,6 +191,11 @@ def show_current_config(conf: Config):
     print(f"Start position: {conf.start_position}")
     print(f"End position: {conf.end_position}")
     print(f"Time out (seconds): {conf.default_timeout_value}")
+    print(f"Beam width: {conf.beam_width}")
+    print(f"Lower bound: {conf.bound}")
+    print(f"Memory budget (MiB): {conf.memory_budget}")
+    print(f"Genetic algorithm populations: {conf.islands}")
+    print(f"Migration interval (rounds): {conf.migration_interval}")
 
 
 settings_menu = Menu(
@@ -130,6 +214,26 @@ settings_menu = Menu(
             "Default timeout value",
             lambda: input_timeout_value(conf=CONF),
         ),
+        (
+            "Beam search width",
+            lambda: input_beam_width(conf=CONF),
+        ),
+        (
+            "Lower bound",
+            lambda: input_bound(conf=CONF),
+        ),
+        (
+            "Memory budget",
+            lambda: input_memory_budget(conf=CONF),
+        ),
+        (
+            "Genetic algorithm populations",
+            lambda: input_islands(conf=CONF),
+        ),
+        (
+            "Migration interval",
+            lambda: input_migration_interval(conf=CONF),
+        ),
         (
             "Start/End Position",
             lambda: input_start_end_pos(conf=CONF),
@@ -163,15 +267,20 @@ def start_routing(conf: Config):
         end_node = SingleNode(coord=conf.end_position, map=map_data)
 
         # start find route
-        instr, total_cost, route, timeout = find_route(
+        instr, total_cost, route, stopped = find_route(
             item_nodes=item_nodes,
             start_node=start_node,
             end_node=end_node,
             algorithm=conf.default_algorithm,
             timeout=conf.default_timeout_value,
+            beam_width=conf.beam_width,
+            bound=conf.bound,
+            memory_budget=conf.memory_budget,
+            islands=conf.islands,
+            migration_interval=conf.migration_interval,
         )
         
-        show_result(map_data, conf, item_locations, instr, total_cost, route, timeout)
+        show_result(map_data, conf, item_locations, instr, total_cost, route, stopped)
 
         # save result to file
         if conf.save_instructions:
@@ -257,16 +366,16 @@ def input_item_ids(conf):
                 item_count,
             )
             if conf.use_random_item:
-                valid_ids = list(conf.prod_db.keys())
-                # item_ids = valid_ids[:-10] + [22]  # Test the duplication check
+                valid_ids = conf.prod_db.ids
+                is_valid_id = conf.prod_db.contains(item_ids)
                 for idx, i in enumerate(item_ids):
-                    if i not in valid_ids:
+                    if not is_valid_id[idx]:
                         # Replace invalid ID with random item
                         random_item_id = item_ids[0]
                         while (
                             random_item_id in item_ids
                         ):  # Avoid duplicate ID; chance is extremely low
-                            random_item_id = choice(valid_ids)
+                            random_item_id = int(choice(valid_ids))
                         item_ids[idx] = random_item_id
                         debug(
                             f"Item {i} does not exist, replacing it with {random_item_id}! "
@@ -320,6 +429,8 @@ def main():
             return -1
 
     read_inventory_data(DATASET_FILE, CONF)
+    warm_up()  # Compile the routing kernels before the first order
+    solver_pool()  # Start the solver processes with the map loaded
     map_text = draw_text_map(CONF.map_data)
     print_map(map_text)
 
@@ -9,7 +9,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    hiddenimports=['lib._kernels'],  # Built by python -m lib.build_kernels
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -1,16 +1,20 @@
 import resource
+import threading
 import time
+from random import sample, seed
 from lib.core import *
 from lib.route import *
 from lib.tui import *
 from lib.genetic import *
 from lib.bnb import *
+from lib.workers import SolverPool
+from time import sleep
 
 DATASET = "data/qvBox-warehouse-data-s23-v01.txt"
 conf = Config()
 read_inventory_data(DATASET, conf)
 prod_db, map_data = conf.prod_db, conf.map_data
-cols, rows = len(map_data), len(map_data[0])
+cols, rows = map_data.cols, map_data.rows
 test_order_lists = [
     [108335],
     [108335, 391825, 340367, 286457, 661741],
@@ -88,6 +92,315 @@ def run_bnb():
     print(f"Total distance is {len(nn_route)} using Nearest-Neighbor algorithm.")
 
 
+def order_matrix(order):
+    item_nodes = prod_to_node(prod_db=prod_db, map_data=map_data, id_list=order)
+    start_node = SingleNode(coord=(0, 0), map=map_data)
+    end_node = SingleNode(coord=(20, 20), map=map_data)
+    all_nodes = [start_node] + item_nodes + [end_node]
+    return generate_cost_graph(all_nodes, start_node, end_node)
+
+
+def check_tour(cm, name, result, nn_cost):
+    """
+    Check that a tour visits every node exactly once, costs what it says,
+    and is no worse than Nearest Neighbor's
+    """
+    cost, path = result
+    assert path is not None, f"{name}: no tour"
+    assert type(cost) is int, f"{name}: cost {cost!r} is not an int"
+    assert sorted(cm.node_of[path]) == list(range(cm.node_count)), (
+        f"{name}: {path} doesn't visit every node exactly once"
+    )
+    assert cm.tour_cost(path) == cost, f"{name}: cost {cost} of {path} is wrong"
+    assert cost <= nn_cost, f"{name}: cost {cost} is worse than {nn_cost}"
+
+
+def test_path_table():
+    """
+    Check that the path table gives the same routes as the plain search
+    between random pairs of empty grids
+    """
+    seed(0)
+    table = get_path_table(map_data)
+    free = [(int(x), int(y)) for x, y in map_data.coords]
+    for start in sample(free, 20):
+        ends = sample(free, 50)
+        found = costs_from(map_data, start, ends)
+        for end in ends:
+            route = table.path(start, end)
+            assert (table.distance(start, end), route) == found[end], (
+                f"Path table route from {start} to {end} differs"
+            )
+    print("Path table OK")
+
+
+def test_astar():
+    """
+    Check that A* gives the same routes as the plain search between random
+    pairs of empty grids
+    """
+    seed(0)
+    free = [(int(x), int(y)) for x, y in map_data.coords]
+    for start, end in zip(sample(free, 200), sample(free, 200)):
+        found = costs_from(map_data, start, [end])
+        assert astar(map_data, start, end) == found[end], (
+            f"A* route from {start} to {end} differs"
+        )
+    print("A* OK")
+
+
+def test_branch_and_bound():
+    """
+    Check branch and bound on the test orders of up to 10 items, starting
+    from the nearest neighbor tour and from nothing
+    """
+    for order in test_order_lists[:3]:
+        cm = order_matrix(order)
+        nn = nearest_neighbor(cm)
+        result = branch_and_bound(cm, nn)
+        check_tour(cm, "branch and bound", result, nn[0])
+        assert branch_and_bound(cm)[0] == result[0], f"{order}: not optimal"
+    print("Branch and bound OK")
+
+
+def test_depth_first_branch_and_bound():
+    """
+    Check that depth-first branch and bound finds tours of the optimal cost
+    """
+    for order in test_order_lists[:3]:
+        cm = order_matrix(order)
+        nn = nearest_neighbor(cm)
+        result = branch_and_bound_dfs(cm, nn)
+        check_tour(cm, "depth-first branch and bound", result, nn[0])
+        best, _ = branch_and_bound(cm, nn)
+        assert result[0] == best, f"{order}: {result[0]} instead of {best}"
+    print("Depth-first branch and bound OK")
+
+
+def test_beam_search():
+    """
+    Check that beam search is no worse than nearest neighbor on every test
+    order, and finds the optimal tour when the beam keeps the whole tree
+    """
+    for order in test_order_lists:
+        cm = order_matrix(order)
+        nn = nearest_neighbor(cm)
+        check_tour(cm, "beam search", beam_search(cm, BEAM_WIDTH, nn), nn[0])
+    cm = order_matrix(test_order_lists[1])
+    best, _ = branch_and_bound(cm)
+    assert beam_search(cm, 10**6)[0] == best, "Wide beam search isn't optimal"
+    print("Beam search OK")
+
+
+def test_assignment_bound():
+    """
+    Check that branch and bound finds tours of the optimal cost with the
+    assignment bound too, and that unknown bounds are refused
+    """
+    for order in test_order_lists[:3]:
+        cm = order_matrix(order)
+        nn = nearest_neighbor(cm)
+        best, _ = branch_and_bound(cm, nn, bound="reduce")
+        for solve in [branch_and_bound, branch_and_bound_dfs]:
+            result = solve(cm, nn, bound="assignment")
+            check_tour(cm, f"{solve.__name__} (assignment)", result, nn[0])
+            assert result[0] == best, f"{order}: {result[0]} instead of {best}"
+    try:
+        branch_and_bound(cm, bound="nope")
+    except ValueError:
+        pass
+    else:
+        assert False, "Unknown bound accepted"
+    print("Assignment bound OK")
+
+
+def test_held_karp():
+    """
+    Check that Held-Karp finds tours of the optimal cost, and refuses orders
+    of more than MAX_ITEMS shelves
+    """
+    for order in test_order_lists[:3]:
+        cm = order_matrix(order)
+        nn = nearest_neighbor(cm)
+        result = held_karp(cm)
+        check_tour(cm, "held-karp", result, nn[0])
+        best, _ = branch_and_bound(cm, nn)
+        assert result[0] == best, f"{order}: {result[0]} instead of {best}"
+
+    orders = read_order_file("data/qvBox-warehouse-orders-list-part01.txt")
+    cm = order_matrix([item for order in orders.values() for item in order][:40])
+    assert cm.node_count - 2 > MAX_ITEMS
+    try:
+        held_karp(cm)
+    except ValueError:
+        pass
+    else:
+        assert False, f"Held-Karp took {cm.node_count - 2} shelves"
+    print("Held-Karp OK")
+
+
+def test_parallel_branch_and_bound():
+    """
+    Check that parallel branch and bound returns a tour of the optimal cost
+    when processes prune with each other's tours
+    """
+    orders = read_order_file("data/qvBox-warehouse-orders-list-part01.txt")
+    for order in list(orders.values())[:12]:
+        cm = order_matrix(order[:8])
+        nn = nearest_neighbor(cm)
+        best, _ = branch_and_bound(cm, nn)
+        for processes in (2, 4):
+            result = parallel_branch_and_bound(cm, processes, nn)
+            check_tour(cm, "parallel branch and bound", result, nn[0])
+            assert result[0] == best, f"{order[:8]}: {result[0]} instead of {best}"
+    print("Parallel branch and bound OK")
+
+
+def route_order(order, algorithm, timeout, **kwargs):
+    item_nodes = prod_to_node(prod_db=prod_db, map_data=map_data, id_list=order)
+    start_node = SingleNode(coord=(0, 0), map=map_data)
+    end_node = SingleNode(coord=(20, 20), map=map_data)
+    return find_route(item_nodes, start_node, end_node, algorithm, timeout, **kwargs)
+
+
+def test_solver_pool():
+    """
+    Check that orders are routed in the same solver process one after
+    another, and that exceptions of the solver are raised again
+    """
+    order = test_order_lists[2]
+    nn_cost = nearest_neighbor(order_matrix(order))[0]
+    pool = solver_pool()
+    pid = pool.workers[0].process.pid
+    for algorithm in ["n", "h", "b"]:
+        _instr, total_cost, _route, stopped = route_order(order, algorithm, 60)
+        assert total_cost <= nn_cost, f"{algorithm}: cost {total_cost} > {nn_cost}"
+        assert not stopped, f"{algorithm}: {stopped}"
+    assert pool.workers[0].process.pid == pid, "Solver process replaced"
+    try:
+        pool.solve(None, "n")
+    except TypeError:
+        pass
+    else:
+        assert False, "Exception of the solver not raised"
+    assert pool.workers[0].process.pid == pid, "Solver process replaced"
+    print("Solver pool OK")
+
+
+def slow_solve(seconds, progress=None):
+    # Reports a tour, then ignores cancellation
+    progress.improve(1, [0])
+    sleep(seconds)
+    return 0, [0]
+
+
+def test_timeout():
+    """
+    Check that a solver cancelled at the timeout gives the best route it
+    found, that a solver that doesn't stop is killed with its last tour,
+    and that a failing solver falls back to nearest neighbor
+    """
+    order = test_order_lists[-1]
+    nn_cost = nearest_neighbor(order_matrix(order))[0]
+    _instr, total_cost, _route, stopped = route_order(order, "b", 2)
+    assert stopped == "stopped at timeout", stopped
+    assert total_cost <= nn_cost, f"Cost {total_cost} > {nn_cost}"
+
+    _instr, total_cost, _route, stopped = route_order(order, "b", 60, bound="nope")
+    assert stopped == "failed, used Nearest neighbor instead", stopped
+    assert total_cost <= nn_cost, f"Cost {total_cost} > {nn_cost}"
+
+    pool = SolverPool(slow_solve)
+    try:
+        pool.solve(10, timeout=0.1)
+    except SolverTimeout as e:
+        assert e.tour == (1, [0]), f"Last tour {e.tour}"
+    else:
+        assert False, "Solver not killed"
+    finally:
+        pool.close()
+    print("Timeout OK")
+
+
+def test_memory_budget():
+    """
+    Check that branch and bound low on memory goes on depth first and still
+    finds the optimal tour, that a solver over its budget is killed, and
+    that processes the solver forks don't count their shared pages
+    """
+    low_memory = threading.Event()
+    progress = Progress(low_memory=low_memory)
+    assert not progress.memory_low()
+    low_memory.set()
+    assert progress.memory_low()
+
+    cm = order_matrix(test_order_lists[2])
+    nn = nearest_neighbor(cm)
+    best, _ = branch_and_bound(cm, nn)
+    checks = []
+    progress.memory_low = lambda: checks.append(True) or low_memory.is_set()
+    result = branch_and_bound(cm, nn, progress=progress)
+    check_tour(cm, "branch and bound low on memory", result, nn[0])
+    assert result[0] == best, f"{result[0]} instead of {best}"
+    # Depth first, memory isn't checked anymore
+    assert len(checks) == 1, "Didn't go on depth first"
+
+    order = test_order_lists[-1]
+    nn_cost = nearest_neighbor(order_matrix(order))[0]
+    _instr, total_cost, _route, stopped = route_order(order, "b", 60, memory_budget=16)
+    assert stopped == "stopped over the memory budget", stopped
+    assert total_cost <= nn_cost, f"Cost {total_cost} > {nn_cost}"
+
+    _instr, _cost, _route, stopped = route_order(
+        test_order_lists[2], "t", 10, memory_budget=512, islands=10
+    )
+    assert stopped != "stopped over the memory budget", "Islands counted as memory"
+    print("Memory budget OK")
+
+
+def test_genetic():
+    """
+    Check that the genetic algorithm is no worse than nearest neighbor, the
+    tour it starts from, and that individuals and paths convert both ways
+    """
+    for order in test_order_lists:
+        cm = order_matrix(order)
+        nn = nearest_neighbor(cm)
+        check_tour(cm, "genetic", genetic(cm, incumbent=nn), nn[0])
+        if cm.node_count > 2:
+            individual = from_path(cm, nn[1])
+            assert cm.tour_cost(to_path(cm, *individual)) == nn[0], "Conversion"
+    print("Genetic OK")
+
+
+def test_island_genetic():
+    """
+    Check that the island model genetic algorithm is no worse than nearest
+    neighbor, with migrations between the islands
+    """
+    for order in test_order_lists:
+        cm = order_matrix(order)
+        nn = nearest_neighbor(cm)
+        result = parallel_genetic(cm, 2, migration_interval=10, incumbent=nn)
+        check_tour(cm, "island genetic", result, nn[0])
+    print("Island genetic OK")
+
+
+def test_local_search():
+    """
+    Check that local search never makes a tour worse, on nearest neighbor
+    and greedy tours
+    """
+    for order in test_order_lists:
+        cm = order_matrix(order)
+        nn = nearest_neighbor(cm)
+        check_tour(cm, "local search", local_search(cm, nn[1]), nn[0])
+        greedy_cost, greedy_path = greedy(cm, init=cm.start)
+        result = local_search(cm, greedy_path)
+        check_tour(cm, "local search", result, greedy_cost)
+    print("Local search OK")
+
+
 def read_order_file(file_path):
     orders = {}
 
@@ -149,6 +462,20 @@ if __name__ == "__main__":
 
     print(f"Failed Cases: {failed_cases}")
 
+    test_path_table()
+    test_astar()
+    test_branch_and_bound()
+    test_depth_first_branch_and_bound()
+    test_beam_search()
+    test_assignment_bound()
+    test_held_karp()
+    test_parallel_branch_and_bound()
+    test_solver_pool()
+    test_timeout()
+    test_memory_budget()
+    test_genetic()
+    test_island_genetic()
+    test_local_search()
     run_bnb()
     # import cProfile
 